@@ -0,0 +1,213 @@
+import json
+import random
+import asyncio
+import logging
+import aiohttp
+import geopandas as gpd
+from concurrent.futures import ThreadPoolExecutor
+from shapely.geometry import Polygon, MultiPolygon, LinearRing
+
+
+class ArcGISQueryError(Exception):
+
+    pass
+
+
+def split_envelope(bbox):
+
+    """
+    :param bbox: (north, south, east, west) bounding box
+    :return: list of the 4 quadrants bounding boxes of bbox
+    """
+
+    north, south, east, west = bbox
+    lat, lng = (north + south) / 2, (east + west) / 2
+
+    return [(north, lat, lng, west), (north, lat, east, lng), (lat, south, lng, west), (lat, south, east, lng)]
+
+
+def esri_geometry(geometry):
+
+    """
+    will convert esri json polygon to shapely geometry - clockwise rings are exteriors, counter clockwise rings are
+    holes of the preceding exterior
+    :param geometry: esri json geometry dict
+    :return: Polygon / MultiPolygon object, None if geometry has no valid rings
+    """
+
+    polygons = []
+    for ring in (geometry or {}).get('rings', []):
+        if len(ring) < 4:
+            continue
+        if polygons and LinearRing(ring).is_ccw:
+            polygons[-1][1].append(ring)
+        else:
+            polygons.append((ring, []))
+
+    polygons = [Polygon(shell, holes) for shell, holes in polygons]
+    if not polygons:
+        return None
+
+    return polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+
+
+def run_async(coroutine):
+
+    """
+    will run coroutine to completion, in a separate thread if called from a running event loop (e.g. notebooks)
+    :param coroutine: coroutine object
+    :return: coroutine result
+    """
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+class FeatureServerFetcher:
+
+    def __init__(self, url, max_connections=8, max_depth=4, page_size=2000, retries=5, backoff=0.5, timeout=60):
+
+        """
+        concurrent fetch of all the features of a bbox from arcgis FeatureServer query url. envelopes that exceed the
+        server transfer limit are split to quadrants (up to max_depth), then paged with resultOffset
+        :param url: FeatureServer query url with ymax, ymin, xmax, xmin placeholders (see utils.ARCGIS_REST_URL)
+        :param max_connections: max # of concurrent connections
+        :param max_depth: max # of envelope splits
+        :param page_size: # of features per page (resultRecordCount)
+        :param retries: # of retries of a failed request
+        :param backoff: first retry delay in seconds, doubled (with jitter) on each retry
+        :param timeout: request timeout in seconds
+        """
+
+        self.url = url
+        self.max_connections = max_connections
+        self.max_depth = max_depth
+        self.page_size = page_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.n_requests = 0
+
+    def fetch(self, bbox):
+
+        """
+        :param bbox: (north, south, east, west) bounding box
+        :return: GeoDataFrame of the bbox features (deduplicated by object id)
+        """
+
+        return self.to_geodataframe(run_async(self.fetch_features(bbox)))
+
+    async def fetch_features(self, bbox):
+
+        """
+        :param bbox: (north, south, east, west) bounding box
+        :return: list of esri json features, deduplicated by object id
+        """
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            features, oid_field = await self.query(session, bbox, 0)
+
+        # features intersecting several envelopes are returned by each of them
+        unique = {}
+        for feature in features:
+            oid = feature.get('attributes', {}).get(oid_field)
+            unique[oid if oid is not None else json.dumps(feature.get('geometry'), sort_keys=True)] = feature
+
+        logging.info(f'fetched {len(unique)} features ({len(features)} with duplicates) in {self.n_requests} requests')
+
+        return list(unique.values())
+
+    async def query(self, session, bbox, depth):
+
+        """
+        :param session: aiohttp ClientSession
+        :param bbox: (north, south, east, west) bounding box
+        :param depth: # of splits of bbox
+        :return: list of esri json features of bbox and object id field name
+        """
+
+        data = await self.get(session, self.url % bbox)
+        oid_field = data.get('objectIdFieldName', 'OBJECTID')
+
+        if not data.get('exceededTransferLimit'):
+            return data.get('features', []), oid_field
+
+        if depth < self.max_depth:
+            results = await asyncio.gather(*(self.query(session, envelope, depth + 1)
+                                             for envelope in split_envelope(bbox)))
+            return [feature for features, _ in results for feature in features], oid_field
+
+        return await self.pages(session, bbox, oid_field), oid_field
+
+    async def pages(self, session, bbox, oid_field):
+
+        """
+        :param session: aiohttp ClientSession
+        :param bbox: (north, south, east, west) bounding box
+        :param oid_field: object id field name, pages are ordered by it
+        :return: list of all the esri json features of bbox, fetched in concurrent resultOffset pages
+        """
+
+        url = self.url % bbox
+        count = (await self.get(session, f'{url}&returnCountOnly=true')).get('count', 0)
+
+        pages = await asyncio.gather(*(self.get(session, f'{url}&orderByFields={oid_field}&resultOffset={offset}'
+                                                         f'&resultRecordCount={self.page_size}')
+                                       for offset in range(0, count, self.page_size)))
+
+        return [feature for page in pages for feature in page.get('features', [])]
+
+    async def get(self, session, url):
+
+        """
+        will request url, retrying with exponential backoff on connection errors, timeouts, 429 / 5xx responses and
+        arcgis error payloads
+        :param session: aiohttp ClientSession
+        :param url: request url
+        :return: response json
+        """
+
+        for attempt in range(self.retries + 1):
+            try:
+                self.n_requests += 1
+                async with session.get(url) as response:
+                    if response.status == 429 or response.status >= 500:
+                        raise ArcGISQueryError(f'http status {response.status}')
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+
+                if 'error' in data:
+                    raise ArcGISQueryError(data['error'])
+
+                return data
+
+            except aiohttp.ClientResponseError:
+                raise  # other 4xx - the request itself is wrong, retry won't help
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, ArcGISQueryError) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                logging.info(f'arcgis request failed, retry in {delay:.1f} seconds. reason: {e}')
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def to_geodataframe(features):
+
+        """
+        :param features: list of esri json features
+        :return: GeoDataFrame of the features attributes and geometries (EPSG:4326)
+        """
+
+        geometries = [esri_geometry(feature.get('geometry')) for feature in features]
+        gdf = gpd.GeoDataFrame([feature.get('attributes', {}) for feature in features], geometry=geometries,
+                               crs='EPSG:4326')
+
+        return gdf[gdf['geometry'].notna()].reset_index(drop=True)
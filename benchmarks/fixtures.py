@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import networkx as nx
+
+CHAIN_NAMES = ('starbucks', 'chipotle', 'pizza-hut', 'walmart', 'dunkin', 'subway', 'cava')
+
+
+def grid_bbox(center=(30.351043, -97.731965), n_rows=30, n_cols=30, spacing=0.002):
+
+    """
+    :return: ymax, ymin, xmax, xmin bounding box of synthetic_graph grid
+    """
+
+    lat, lng = center
+
+    return (lat + spacing * (n_rows - 1) / 2, lat - spacing * (n_rows - 1) / 2,
+            lng + spacing * (n_cols - 1) / 2, lng - spacing * (n_cols - 1) / 2)
+
+
+def synthetic_graph(center=(30.351043, -97.731965), n_rows=30, n_cols=30, spacing=0.002, speed_kph=30,
+                    arterial_every=5, arterial_speed_kph=60):
+
+    """
+    will build offline grid road graph in osmnx format (MultiDiGraph with x, y nodes and length, speed_kph,
+    travel_time edges), two way streets between neighbour nodes, every n-th row / column is a faster arterial
+    :param center: lat, lng of the grid center
+    :param n_rows: # of grid rows
+    :param n_cols: # of grid columns
+    :param spacing: degrees between neighbour nodes
+    :param speed_kph: streets speed
+    :param arterial_every: every n-th row / column is arterial
+    :param arterial_speed_kph: arterials speed
+    :return:
+    """
+
+    ymax, ymin, xmax, xmin = grid_bbox(center, n_rows, n_cols, spacing)
+    lat_scale = np.cos(np.radians(center[0]))
+
+    G = nx.MultiDiGraph(crs='epsg:4326')
+    for row in range(n_rows):
+        for col in range(n_cols):
+            G.add_node(row * n_cols + col + 1, x=xmin + col * spacing, y=ymin + row * spacing)
+
+    for row in range(n_rows):
+        for col in range(n_cols):
+            node = row * n_cols + col + 1
+            neighbours = []
+            if col < n_cols - 1:  # east neighbour, along the row
+                neighbours.append((node + 1, row % arterial_every == 0, spacing * 111320 * lat_scale))
+            if row < n_rows - 1:  # north neighbour, along the column
+                neighbours.append((node + n_cols, col % arterial_every == 0, spacing * 110540))
+
+            for neighbour, arterial, meters in neighbours:
+                speed = arterial_speed_kph if arterial else speed_kph
+                for u, v in ((node, neighbour), (neighbour, node)):
+                    G.add_edge(u, v, osmid=len(G.edges), length=meters, speed_kph=speed,
+                               travel_time=meters / (speed / 3.6))
+
+    return G
+
+
+def synthetic_residence_df(bbox, n_residences=2000, n_block_groups=25, seed=0):
+
+    """
+    will generate residence_df (get_residence_df format) of random buildings within bbox
+    :param bbox: ymax, ymin, xmax, xmin bounding box
+    :param n_residences: # of buildings
+    :param n_block_groups: # of block groups (square grid cells of the bbox)
+    :param seed: random seed
+    :return:
+    """
+
+    rng = np.random.default_rng(seed)
+    ymax, ymin, xmax, xmin = bbox
+    lat, lng = rng.uniform(ymin, ymax, n_residences), rng.uniform(xmin, xmax, n_residences)
+
+    side = int(np.ceil(np.sqrt(n_block_groups)))
+    block_row = np.minimum(((lat - ymin) / (ymax - ymin) * side).astype(int), side - 1)
+    block_col = np.minimum(((lng - xmin) / (xmax - xmin) * side).astype(int), side - 1)
+
+    residence_df = pd.DataFrame({'OBJECTID': np.arange(n_residences),
+                                 'BlockgroupID': [f'bg_{row}_{col}' for row, col in zip(block_row, block_col)],
+                                 'lat': lat,
+                                 'lng': lng,
+                                 'area': rng.uniform(1e-9, 1e-8, n_residences)})
+
+    return gpd.GeoDataFrame(residence_df, geometry=gpd.points_from_xy(lng, lat), crs='EPSG:4326')
+
+
+def synthetic_pois_df(bbox, n_pois=500, seed=1):
+
+    """
+    will generate pois_df (get_kaggle_pois_data format) of random chain stores within bbox
+    :param bbox: ymax, ymin, xmax, xmin bounding box
+    :param n_pois: # of pois
+    :param seed: random seed
+    :return:
+    """
+
+    rng = np.random.default_rng(seed)
+    ymax, ymin, xmax, xmin = bbox
+    lat, lng = rng.uniform(ymin, ymax, n_pois), rng.uniform(xmin, xmax, n_pois)
+
+    pois_df = pd.DataFrame({'poi_name': rng.choice(CHAIN_NAMES, n_pois), 'lat': lat, 'lng': lng})
+    pois_df['id'] = pois_df.index
+
+    return gpd.GeoDataFrame(pois_df, geometry=gpd.points_from_xy(lng, lat))
@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import logging
+import subprocess
+import fire
+
+HEAVY_MODULES = ('osmnx', 'networkx', 'geopandas', 'keplergl', 'taxicab', 'aiohttp', 'kaggle', 'pyarrow', 'scipy')
+
+# imports the modules of the generation only path (pre built graph, no viz) and reports the import time and which
+# heavy modules got loaded
+IMPORT_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import %s
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'loaded': [name for name in %r if name in sys.modules]}))
+"""
+
+
+def import_time(module, repeat=3):
+
+    """
+    :param module: module name to import
+    :param repeat: # of fresh interpreters to import module in, the fastest is taken (first one warms the disk cache)
+    :return: dict of import seconds and loaded heavy modules
+    """
+
+    repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    results = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT % (module, HEAVY_MODULES)],
+                                         cwd=repo_path)
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    return min(results, key=lambda result: result['seconds'])
+
+
+def main(modules=('timeline_generator', 'main'), budget_seconds=1.5, repeat=3, strict=True):
+
+    """
+    measures the import time of the generation only path (MobilePhone on a pre built graph, no viz) in fresh
+    interpreters, and checks it against budget_seconds
+    :param modules: modules to measure
+    :param budget_seconds: max import seconds of each module
+    :param repeat: # of imports of each module, the fastest is taken
+    :param strict: if True, will exit with a non zero status when a module is over budget
+    :return: dict of module -> import seconds, loaded heavy modules and whether it is within budget
+    """
+
+    results = {}
+    for module in modules:
+        result = import_time(module, repeat)
+        result['within_budget'] = result['seconds'] <= budget_seconds and not result['loaded']
+        results[module] = result
+
+        logging.info(f'import {module} - {result["seconds"]:.2f} seconds (budget {budget_seconds}), '
+                     f'heavy modules loaded: {result["loaded"] or None}')
+
+    over_budget = [module for module, result in results.items() if not result['within_budget']]
+    if strict and over_budget:
+        logging.error(f'import budget exceeded: {over_budget}')
+        sys.exit(1)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.INFO)
+
+    fire.Fire(main)
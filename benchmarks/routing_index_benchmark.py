@@ -0,0 +1,110 @@
+import json
+import time
+import logging
+import fire
+import numpy as np
+import pandas as pd
+import osmnx as ox
+import taxicab as tc
+
+from utils import get_osmnx_graph
+from routing_index import RoutingIndex
+from benchmarks.fixtures import synthetic_graph
+
+
+def sample_locations(G, n_locations, seed=0):
+
+    """
+    will sample locations nearby random graph nodes
+    :param G: MultiDiGraph object
+    :param n_locations: # of locations to sample
+    :param seed: random seed
+    :return: pandas df with lat, lng columns
+    """
+
+    rng = np.random.default_rng(seed)
+    nodes = rng.choice(np.array(G.nodes), size=n_locations)
+
+    return pd.DataFrame({'lat': [G.nodes[node]['y'] + rng.normal(0, 0.0005) for node in nodes],
+                         'lng': [G.nodes[node]['x'] + rng.normal(0, 0.0005) for node in nodes]})
+
+
+def time_queries(shortest_path, pairs):
+
+    """
+    :param shortest_path: shortest_path function
+    :param pairs: list of (orig, dest) tuples
+    :return: dict of timing results
+    """
+
+    failures = 0
+    start = time.perf_counter()
+    for orig, dest in pairs:
+        try:
+            shortest_path(orig, dest)
+        except Exception:
+            failures += 1
+    seconds = time.perf_counter() - start
+
+    return {'queries': len(pairs), 'failures': failures, 'seconds': seconds,
+            'ms_per_query': 1000 * seconds / max(len(pairs), 1)}
+
+
+def main(lat=None, lng=None, radius=2000, import_gpickle_path=None, n_locations=200, n_queries=500, seed=0,
+         output_path=None):
+
+    """
+    benchmark RoutingIndex route queries against taxicab shortest_path
+    :param lat: latitude of the graph center (when graph is queried from osm), if no graph source is passed
+                will run on offline synthetic grid graph
+    :param lng: longitude of the graph center (when graph is queried from osm)
+    :param radius: radius in meters
+    :param import_gpickle_path: if passed, will load the graph from gpickle
+    :param n_locations: # of candidate locations (stand in for residences and pois)
+    :param n_queries: # of route queries
+    :param seed: random seed
+    :param output_path: if passed, will save results json
+    :return:
+    """
+
+    if import_gpickle_path:
+        G = get_osmnx_graph(import_gpickle_path=import_gpickle_path)
+    elif lat is not None and lng is not None:
+        G = get_osmnx_graph(ox.utils_geo.bbox_from_point((lat, lng), radius))
+    else:
+        G = synthetic_graph()
+
+    locations_df = sample_locations(G, n_locations, seed)
+    locations = list(zip(locations_df['lat'], locations_df['lng']))
+    rng = np.random.default_rng(seed)
+    pairs = [(locations[i], locations[j]) for i, j in rng.integers(0, len(locations), size=(n_queries, 2)) if i != j]
+
+    results = {'nodes': G.number_of_nodes(), 'edges': G.number_of_edges(), 'locations': n_locations}
+
+    results['taxicab'] = time_queries(lambda orig, dest: tc.distance.shortest_path(G, orig, dest), pairs)
+
+    start = time.perf_counter()
+    routing_index = RoutingIndex(G, [locations_df])
+    results['index_build_seconds'] = time.perf_counter() - start
+
+    results['index_cold'] = time_queries(routing_index.shortest_path, pairs)
+    results['index_warm'] = time_queries(routing_index.shortest_path, pairs)
+
+    start = time.perf_counter()
+    routing_index.precompute()
+    results['index_precompute_seconds'] = time.perf_counter() - start
+
+    logging.info(json.dumps(results, indent=2))
+
+    if output_path:
+        with open(output_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.INFO)
+
+    fire.Fire(main)
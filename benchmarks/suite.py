@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import tempfile
+import subprocess
+import fire
+import pandas as pd
+
+from main import generate_mobile, new_mobile_phone
+from route_cache import RouteCache, NO_ROUTE
+from routing_index import RoutingIndex
+from compact_graph import CompactGraph
+from population_timeline import PopulationTimeline
+from writers import get_writer
+from pipeline import WritePipeline
+from benchmarks.fixtures import grid_bbox, synthetic_graph, synthetic_residence_df, synthetic_pois_df
+from benchmarks import import_budget
+
+
+def bench(func, repeat):
+
+    """
+    :param func: function without params to time
+    :param repeat: # of calls
+    :return: dict of timing results
+    """
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    seconds = time.perf_counter() - start
+
+    return {'calls': repeat, 'seconds': seconds, 'ms_per_call': 1000 * seconds / repeat}
+
+
+def git_commit():
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def main(fleet_sizes=(10, 50), days=(1, 7), grid_size=30, n_residences=2000, n_pois=500, n_routes=50,
+         repeat=20, routing='taxicab', seed=0, import_budget_seconds=1.5, write_queue_size=0,
+         output_path=None):
+
+    """
+    offline benchmark of the generation pipeline on a synthetic grid road graph and generated residences / pois
+    :param fleet_sizes: # of mobile devices of the end to end runs
+    :param days: timeline lengths (days) of the end to end runs
+    :param grid_size: # of rows / columns of the synthetic grid graph
+    :param n_residences: # of synthetic residences
+    :param n_pois: # of synthetic pois
+    :param n_routes: # of calc_route calls
+    :param repeat: # of calls of the signals / timeline micro benchmarks
+    :param routing: 'taxicab' / 'index' (RoutingIndex)
+    :param seed: random seed
+    :param import_budget_seconds: max import seconds of the generation only path (see import_budget)
+    :param write_queue_size: if > 0, the end to end runs write with a background WritePipeline of this queue size
+    :param output_path: if passed, will save results json (compare between commits)
+    :return:
+    """
+
+    assert routing in ('taxicab', 'index'), f"routing should be 'taxicab' or 'index', got {routing}"
+
+    graph = synthetic_graph(n_rows=grid_size, n_cols=grid_size)
+    bbox = grid_bbox(n_rows=grid_size, n_cols=grid_size)
+    residence_df = synthetic_residence_df(bbox, n_residences, seed=seed)
+    pois_df = synthetic_pois_df(bbox, n_pois, seed=seed + 1)
+
+    results = {'commit': git_commit(),
+               'python': sys.version.split()[0],
+               'platform': platform.platform(),
+               'params': {'fleet_sizes': list(fleet_sizes), 'days': list(days), 'grid_size': grid_size,
+                          'n_residences': n_residences, 'n_pois': n_pois, 'routing': routing, 'seed': seed,
+                          'write_queue_size': write_queue_size},
+               'imports': import_budget.main(budget_seconds=import_budget_seconds, strict=False),
+               'micro': {},
+               'end_to_end': []}
+
+    start = time.perf_counter()
+    routing_index = RoutingIndex(graph, [residence_df, pois_df]) if routing == 'index' else None
+    results['micro']['routing_index_build'] = {'seconds': time.perf_counter() - start} if routing_index else None
+
+    edge_geometries = CompactGraph.from_networkx(graph) if routing_index is None else None
+    mobile_phone = new_mobile_phone(0, graph, residence_df, pois_df, seed=seed, routing_index=routing_index,
+                                    edge_geometries=edge_geometries)
+
+    results['micro']['generate_mobile_timeline_7_days'] = bench(
+        lambda: mobile_phone.generate_mobile_timeline('2022-01-03', '2022-01-09', max_residences=2, max_pois=2),
+        repeat)
+
+    results['micro']['population_timeline_1000x30'] = bench(
+        lambda: PopulationTimeline(residence_df, pois_df, 1000, '2022-01-01', '2022-01-30', seed=seed), 1)
+
+    locations = list(zip(residence_df['lat'], residence_df['lng']))[:n_routes + 1]
+    pairs = list(zip(locations[:-1], locations[1:]))
+    pairs_iter = iter(pairs)
+    mobile_phone.mobile_routs = RouteCache()
+    results['micro']['calc_route_cold'] = bench(lambda: mobile_phone.calc_route(*next(pairs_iter)), len(pairs))
+    pairs_iter = iter(pairs)
+    results['micro']['calc_route_cached'] = bench(lambda: mobile_phone.calc_route(*next(pairs_iter)), len(pairs))
+
+    day = pd.Timestamp('2022-01-03')
+    results['micro']['generate_static_signals_24h'] = bench(
+        lambda: mobile_phone.generate_static_signals(30.35, -97.73, day, day + pd.Timedelta(hours=24)), repeat)
+
+    route = next(route for route in (mobile_phone.calc_route(*pair) for pair in pairs) if route != NO_ROUTE)
+    results['micro']['generate_route_signals'] = bench(
+        lambda: mobile_phone.generate_route_signals(route[0], day), repeat)
+    results['micro']['generate_route_signals_travel_time'] = bench(
+        lambda: mobile_phone.generate_route_signals(route[0], day, drive_seconds=route[1]), repeat)
+
+    for n_days in days:
+        end_date = (pd.Timestamp('2022-01-03') + pd.Timedelta(days=n_days - 1)).strftime('%Y-%m-%d')
+        for n_mobiles in fleet_sizes:
+            with tempfile.TemporaryDirectory() as export_path:
+                writer = get_writer(export_path)
+                route_cache = RouteCache()
+                start = time.perf_counter()
+                pipeline = WritePipeline(write_queue_size) if write_queue_size > 0 else None
+                for i in range(n_mobiles):
+                    generate_mobile(i, graph, residence_df, pois_df, '2022-01-03', end_date, export_path, writer,
+                                    seed=seed, route_cache=route_cache, routing_index=routing_index,
+                                    edge_geometries=edge_geometries, pipeline=pipeline)
+                if pipeline is not None:
+                    pipeline.close()
+                writer.close()
+                seconds = time.perf_counter() - start
+
+            results['end_to_end'].append({'n_mobiles': n_mobiles, 'days': n_days, 'seconds': seconds,
+                                          'mobiles_per_second': n_mobiles / seconds,
+                                          'route_cache': route_cache.stats(),
+                                          'write_pipeline': pipeline.stats() if pipeline is not None else None})
+            logging.info(f'end to end - {results["end_to_end"][-1]}')
+
+    if output_path:
+        with open(output_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.INFO)
+
+    fire.Fire(main)
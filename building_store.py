@@ -0,0 +1,70 @@
+import logging
+import fire
+import pandas as pd
+import geopandas as gpd
+from geolib import geohash
+
+from grid_store import write_grid_store, read_grid_store
+
+
+def build_building_store(footprints_paths, store_path, block_groups_path=None):
+
+    """
+    will build a local building store (GeoParquet) out of Microsoft Building Footprints files.
+    buildings are sorted by grid cell (see write_grid_store), so a bbox query reads only the cells it covers
+    download footprints from - https://github.com/microsoft/USBuildingFootprints
+    :param footprints_paths: path / list of paths of footprints files (geojson / geojsonl)
+    :param store_path: path of the output parquet file
+    :param block_groups_path: census block groups file (with GEOID column), if not passed buildings are grouped by
+                              geohash 6 cells instead of block groups
+    :return:
+    """
+
+    logging.info('build building store - START')
+
+    footprints_paths = [footprints_paths] if isinstance(footprints_paths, str) else footprints_paths
+    buildings_df = pd.concat([gpd.read_file(path)[['geometry']] for path in footprints_paths], ignore_index=True)
+    buildings_df = gpd.GeoDataFrame(buildings_df, geometry='geometry', crs='EPSG:4326')
+
+    centroids = buildings_df['geometry'].centroid
+    buildings_df['lat'] = centroids.y
+    buildings_df['lng'] = centroids.x
+    buildings_df['area'] = buildings_df.area
+
+    if block_groups_path:
+        block_groups_df = gpd.read_file(block_groups_path)[['GEOID', 'geometry']].to_crs('EPSG:4326')
+        points_df = gpd.GeoDataFrame(geometry=gpd.points_from_xy(buildings_df['lng'], buildings_df['lat']),
+                                     index=buildings_df.index, crs='EPSG:4326')
+        joined_df = gpd.sjoin(points_df, block_groups_df, how='left', predicate='within')
+        buildings_df['BlockgroupID'] = joined_df.loc[~joined_df.index.duplicated(), 'GEOID']
+    else:
+        buildings_df['BlockgroupID'] = [geohash.encode(lat, lng, 6)
+                                        for lat, lng in zip(buildings_df['lat'], buildings_df['lng'])]
+
+    buildings_df['OBJECTID'] = buildings_df.index
+
+    write_grid_store(buildings_df, store_path)
+
+    logging.info(f'build building store - END, {len(buildings_df)} buildings saved to {store_path}')
+
+
+def query_building_store(store_path, bbox):
+
+    """
+    will return all store buildings within bbox (no records limit)
+    :param store_path: building store path (output of build_building_store)
+    :param bbox: ymax, ymin, xmax, xmin bounding box
+    :return: geopandas df of buildings
+    """
+
+    buildings_df = read_grid_store(store_path, bbox)
+    buildings_df['geometry'] = gpd.GeoSeries.from_wkb(buildings_df['geometry'])
+
+    return gpd.GeoDataFrame(buildings_df, geometry='geometry', crs='EPSG:4326')
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.INFO)
+
+    fire.Fire(build_building_store)
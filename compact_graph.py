@@ -0,0 +1,177 @@
+import os
+import shutil
+import logging
+import numpy as np
+
+ARRAYS = ('node_ids', 'node_x', 'node_y', 'indptr', 'indices', 'length', 'travel_time', 'geometry_offsets',
+          'geometry_coords')
+
+
+class CompactGraph:
+
+    def __init__(self, **arrays):
+
+        """
+        road graph as flat numpy arrays - nodes sorted by id, CSR adjacency (parallel edges reduced to the
+        shortest one), edges length, travel_time and geometries (coords of all edges, sliced by geometry_offsets).
+        loaded with mmap, all processes share one physical copy of the arrays
+        :param arrays: ARRAYS numpy arrays
+        """
+
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.path = None
+
+    @classmethod
+    def from_networkx(cls, G):
+
+        """
+        :param G: MultiDiGraph object (with length and travel_time edges attributes)
+        :return: CompactGraph object
+        """
+
+        node_ids = np.sort(np.array(G.nodes, dtype=np.int64))
+        node_x = np.array([G.nodes[node]['x'] for node in node_ids], dtype=np.float64)
+        node_y = np.array([G.nodes[node]['y'] for node in node_ids], dtype=np.float64)
+
+        # if there are parallel edges, select the shortest in length
+        edges = {}
+        for u, v, data in G.edges(data=True):
+            if (u, v) not in edges or data['length'] < edges[(u, v)]['length']:
+                edges[(u, v)] = data
+
+        u = np.searchsorted(node_ids, np.array([edge[0] for edge in edges], dtype=np.int64))
+        v = np.searchsorted(node_ids, np.array([edge[1] for edge in edges], dtype=np.int64))
+        order = np.lexsort((v, u))
+        edges_data = list(edges.values())
+
+        coords = []
+        for i in order:
+            data = edges_data[i]
+            if 'geometry' in data:
+                coords.append(np.asarray(data['geometry'].coords, dtype=np.float64)[:, :2])
+            else:
+                # otherwise, the edge is a straight line from node to node
+                coords.append(np.array([[node_x[u[i]], node_y[u[i]]], [node_x[v[i]], node_y[v[i]]]]))
+
+        return cls(node_ids=node_ids,
+                   node_x=node_x,
+                   node_y=node_y,
+                   indptr=np.concatenate([[0], np.cumsum(np.bincount(u, minlength=len(node_ids)))]).astype(np.int64),
+                   indices=v[order].astype(np.int32),
+                   length=np.array([edges_data[i]['length'] for i in order], dtype=np.float64),
+                   travel_time=np.array([edges_data[i].get('travel_time', np.nan) for i in order], dtype=np.float64),
+                   geometry_offsets=np.concatenate([[0], np.cumsum([len(c) for c in coords])]).astype(np.int64),
+                   geometry_coords=np.concatenate(coords) if coords else np.empty((0, 2)))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+
+        """
+        :param path: directory of the graph arrays (output of save)
+        :param mmap_mode: np.load mmap_mode, None will read the arrays to memory
+        :return: CompactGraph object
+        """
+
+        graph = cls(**{name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS})
+        if mmap_mode:
+            graph.path = path
+
+        return graph
+
+    def __reduce__(self):
+
+        # memory mapped graph is pickled by path, so spawned workers map the same files instead of copying the arrays
+        if self.path:
+            return CompactGraph.load, (self.path,)
+
+        return _from_arrays, ({name: getattr(self, name) for name in ARRAYS},)
+
+    def save(self, path):
+
+        """
+        will save the graph arrays to a temp directory first and then move it to path, so an interrupted save never
+        leaves a partial set of arrays to be loaded
+        :param path: directory to save the graph arrays to
+        :return:
+        """
+
+        tmp_path = f'{path.rstrip(os.sep)}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), getattr(self, name))
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+        logging.info(f'compact graph with {len(self.node_ids)} nodes and {len(self.indices)} edges saved to {path}')
+
+    def csgraph(self, weight='length'):
+
+        """
+        :param weight: edge attribute to use as weight - 'length' / 'travel_time'
+        :return: scipy csr_matrix of the graph (shares the graph arrays)
+        """
+
+        from scipy.sparse import csr_matrix
+
+        # explicit zeros are dropped by csgraph, keep zero weight edges traversable
+        data = np.maximum(getattr(self, weight), 1e-6)
+
+        return csr_matrix((data, self.indices, self.indptr), shape=(len(self.node_ids), len(self.node_ids)))
+
+    def node_index(self, node_ids):
+
+        """
+        :param node_ids: array of node ids
+        :return: array of nodes positions
+        """
+
+        return np.searchsorted(self.node_ids, node_ids)
+
+    def edge_index(self, u, v):
+
+        """
+        :param u: edge source node position
+        :param v: edge target node position
+        :return: edge position
+        """
+
+        start, end = self.indptr[u], self.indptr[u + 1]
+        edge = start + np.searchsorted(self.indices[start:end], v)
+        if edge >= end or self.indices[edge] != v:
+            raise KeyError(f'no edge between nodes positions {u} -> {v}')
+
+        return edge
+
+    def path_edges(self, node_ids):
+
+        """
+        :param node_ids: list of path node ids
+        :return: list of path edges positions
+        """
+
+        path = self.node_index(np.asarray(node_ids, dtype=np.int64))
+
+        return [self.edge_index(u, v) for u, v in zip(path[:-1], path[1:])]
+
+    def path_coords(self, node_ids):
+
+        """
+        will return the coords of a path, concatenated edges geometries
+        :param node_ids: list of path node ids
+        :return: (n, 2) array of lng, lat coords
+        """
+
+        if len(node_ids) < 2:  # no edges, the path is its node (if any)
+            path = self.node_index(np.asarray(node_ids, dtype=np.int64))
+            return np.column_stack([self.node_x[path], self.node_y[path]])
+
+        return np.concatenate([self.geometry_coords[self.geometry_offsets[edge]:self.geometry_offsets[edge + 1]]
+                               for edge in self.path_edges(node_ids)])
+
+
+def _from_arrays(arrays):
+
+    return CompactGraph(**arrays)
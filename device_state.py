@@ -0,0 +1,70 @@
+import json
+import sqlite3
+import logging
+import threading
+
+
+class DeviceStateStore:
+
+    def __init__(self, path, commit_every=100):
+
+        """
+        mobile devices states (output of MobilePhone.state) in sqlite file, to extend their timelines in later runs
+        (open one instance per process, sqlite connections can't be shared across a fork. the connection is shared
+        with the process writer threads, see pipeline.WritePipeline)
+        :param path: sqlite file path
+        :param commit_every: # of saved states to buffer before committing to disk
+        """
+
+        self.path = path
+        self.commit_every = commit_every
+        self.pending = 0
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS devices (mobile_id PRIMARY KEY, state TEXT)')
+        self.conn.commit()
+
+    def save(self, state):
+
+        """
+        :param state: mobile device state dict (output of MobilePhone.state)
+        :return:
+        """
+
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO devices VALUES (?, ?)', (state['mobile_id'], json.dumps(state)))
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.flush()
+
+    def load(self, mobile_id):
+
+        """
+        :param mobile_id: unique identifier of the mobile device
+        :return: mobile device state dict, None if not saved
+        """
+
+        with self.lock:
+            row = self.conn.execute('SELECT state FROM devices WHERE mobile_id=?', (mobile_id,)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def flush(self):
+
+        """
+        commit buffered states to disk
+        :return:
+        """
+
+        try:
+            with self.lock:
+                self.conn.commit()
+                self.pending = 0
+        except sqlite3.OperationalError as e:
+            logging.info(f'failed to commit devices states to {self.path}, will retry on next flush. reason: {e}')
+
+    def close(self):
+
+        self.flush()
+        with self.lock:
+            self.conn.close()
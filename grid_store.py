@@ -0,0 +1,57 @@
+import numpy as np
+import pyarrow.parquet as pq
+
+CELL_SIZE = 0.01  # degrees, ~1km grid cells of the spatial index
+ROW_GROUP_SIZE = 20000
+
+
+def grid_cell(lat, lng):
+
+    """
+    :param lat: array of latitudes
+    :param lng: array of longitudes
+    :return: array of grid cells ids, sorting by cell keeps every cells row (same lat band) contiguous
+    """
+
+    lat_cell = np.floor((np.asarray(lat) + 90) / CELL_SIZE).astype(np.int64)
+    lng_cell = np.floor((np.asarray(lng) + 180) / CELL_SIZE).astype(np.int64)
+
+    return lat_cell * int(round(360 / CELL_SIZE)) + lng_cell
+
+
+def write_grid_store(df, store_path, row_group_size=ROW_GROUP_SIZE):
+
+    """
+    will save locations df as parquet file sorted by grid cell in small row groups, so a bbox query reads only
+    the row groups of the cells it covers
+    :param df: pandas / geopandas df with lat, lng columns
+    :param store_path: path of the output parquet file
+    :param row_group_size: # of rows per row group
+    :return:
+    """
+
+    df = df.assign(cell=grid_cell(df['lat'], df['lng'])).sort_values(['cell', 'lng'])
+    df.to_parquet(store_path, index=False, row_group_size=row_group_size)
+
+
+def read_grid_store(store_path, bbox, columns=None):
+
+    """
+    will return all store rows within bbox
+    :param store_path: path of parquet file (output of write_grid_store)
+    :param bbox: ymax, ymin, xmax, xmin bounding box
+    :param columns: columns to read, if None will read all columns
+    :return: pandas df
+    """
+
+    ymax, ymin, xmax, xmin = bbox
+
+    # each cells row is a contiguous range of cells ids, row groups statistics skip everything else
+    filters = []
+    for lat_cell in range(int(np.floor((ymin + 90) / CELL_SIZE)), int(np.floor((ymax + 90) / CELL_SIZE)) + 1):
+        cell_lat = (lat_cell + 0.5) * CELL_SIZE - 90
+        filters.append([('cell', '>=', int(grid_cell(cell_lat, xmin))), ('cell', '<=', int(grid_cell(cell_lat, xmax))),
+                        ('lat', '>=', ymin), ('lat', '<=', ymax), ('lng', '>=', xmin), ('lng', '<=', xmax)])
+
+    return pq.read_table(store_path, columns=columns, filters=filters).to_pandas().drop(columns='cell',
+                                                                                          errors='ignore')
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import cProfile
+import tracemalloc
+import functools
+import threading
+from contextlib import contextmanager
+
+_STATE = {'enabled': False}
+_STAGES = {}  # stage -> [calls, seconds]
+_LOCK = threading.Lock()  # stages are recorded by the writer threads too (see pipeline.WritePipeline)
+
+
+def enable(enabled=True):
+
+    """
+    switch stages timing on / off (off by default, timed functions then cost a single dict lookup)
+    :param enabled: bool
+    :return:
+    """
+
+    _STATE['enabled'] = enabled
+
+
+def record(stage, seconds, calls=1):
+
+    """
+    :param stage: stage name
+    :param seconds: wall time seconds
+    :param calls: # of calls
+    :return:
+    """
+
+    with _LOCK:
+        stats = _STAGES.setdefault(stage, [0, 0.0])
+        stats[0] += calls
+        stats[1] += seconds
+
+
+@contextmanager
+def timed_stage(stage):
+
+    """
+    context manager that records the wall time of its block under stage
+    :param stage: stage name
+    :return:
+    """
+
+    if not _STATE['enabled']:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+
+    """
+    decorator that records the wall time and calls of a function under stage
+    :param stage: stage name
+    :return:
+    """
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _STATE['enabled']:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot(reset=False):
+
+    """
+    :param reset: if True, will clear the recorded stages (e.g. after sending a worker stages to the main process)
+    :return: dict of stage -> (calls, seconds)
+    """
+
+    with _LOCK:
+        stages = {stage: tuple(stats) for stage, stats in _STAGES.items()}
+        if reset:
+            _STAGES.clear()
+
+    return stages
+
+
+def merge(stages):
+
+    """
+    will add stages of another process (output of snapshot) to this process stages
+    :param stages: dict of stage -> (calls, seconds)
+    :return:
+    """
+
+    for stage, (calls, seconds) in stages.items():
+        record(stage, seconds, calls)
+
+
+def summary(**extra):
+
+    """
+    :param extra: extra summary items, e.g route cache stats
+    :return: dict of stages calls, total and mean wall time, sorted by total time
+    """
+
+    stages = {stage: {'calls': calls, 'seconds': round(seconds, 6), 'mean_ms': round(1000 * seconds / calls, 3)}
+              for stage, (calls, seconds) in sorted(snapshot().items(), key=lambda x: -x[1][1])}
+
+    return {'stages': stages, **extra}
+
+
+def write_summary(path, **extra):
+
+    """
+    will save summary as json
+    :param path: json file path
+    :param extra: extra summary items
+    :return:
+    """
+
+    with open(path, 'w') as file:
+        json.dump(summary(**extra), file, indent=2, default=str)
+
+
+class Profiler:
+
+    def __init__(self, mode=None, top=25):
+
+        """
+        optional cProfile / tracemalloc capture of a run
+        :param mode: None, 'cprofile', 'tracemalloc' or 'all'
+        :param top: # of top allocations lines to report
+        """
+
+        assert mode in (None, 'cprofile', 'tracemalloc', 'all'), f"unknown profile mode {mode}"
+
+        self.mode = mode
+        self.top = top
+        self.profile = cProfile.Profile() if mode in ('cprofile', 'all') else None
+        self.trace_memory = mode in ('tracemalloc', 'all')
+
+    def start(self):
+
+        if self.profile:
+            self.profile.enable()
+        if self.trace_memory:
+            tracemalloc.start()
+
+        return self
+
+    def stop(self, export_path, name='main'):
+
+        """
+        will stop capturing, dump cProfile stats to {export_path}/{name}.prof
+        :param export_path: path to save the profile files
+        :param name: profile files name (e.g main / worker pid)
+        :return: dict of memory stats (tracemalloc mode)
+        """
+
+        memory = {}
+
+        if self.profile:
+            self.profile.disable()
+            self.profile.dump_stats(os.path.join(export_path, f'{name}.prof'))
+
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top_lines = tracemalloc.take_snapshot().statistics('lineno')[:self.top]
+            tracemalloc.stop()
+            memory = {'current_mb': current / 2 ** 20, 'peak_mb': peak / 2 ** 20,
+                      'top_allocations': [str(line) for line in top_lines]}
+
+        return memory
@@ -1,16 +1,294 @@
-import osmnx as ox
 import os
+import json
+import glob
+import shutil
+import time
 import logging
 import fire
+import pandas as pd
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
 from geolib import geohash
 
 import warnings
 
-from utils import get_residence_df, get_kaggle_pois_data, get_osmnx_graph, export_timeline_viz, US_GEO_CELLS
-from timeline_generator import MobilePhone
+from utils import get_residence_df, get_kaggle_pois_data, get_osmnx_graph, snap_to_edges, bbox_from_point, \
+    get_location_snaps, get_edge_geometries, load_compact_graph, US_GEO_CELLS
+from timeline_generator import MobilePhone, mobile_rng
+from route_cache import get_route_cache, routing_key
+from routing_index import build_routing_index
+from writers import get_writer
+from manifest import read_manifest, clear_manifest, remove_incomplete_parquet
+from population_timeline import PopulationTimeline
+from compact_graph import CompactGraph
+from device_state import DeviceStateStore
+from pipeline import WritePipeline, SignalsStream
+from viz import KeplerViz, save_combined_viz, clear_viz_parts
+import instrumentation
 
+# per worker process state, populated once by init_worker (inherited on fork, pickled once per worker on spawn)
+_WORKER_CONTEXT = {}
 
-def main(lat, lng, radius, n_mobiles, start_date, end_date, export_path, kaggle_username, kaggle_key, graph=None, viz_timeline=False):
+
+def generate_mobile(mobile_id, graph, residence_df, pois_df, start_date, end_date, export_path, writer,
+                    viz=None, seed=None, route_cache=None, routing_index=None, location_snaps=None,
+                    population=None, drive_model='random', edge_geometries=None, state_store=None, extend=False,
+                    pipeline=None):
+
+    """
+    will generate a single mobile device timeline and signals and save them with writer
+    :param mobile_id: unique int identifier of the mobile device
+    :param graph: MultiDiGraph object
+    :param residence_df: pandas df of residence locations
+    :param pois_df: pandas df of pois locations
+    :param start_date: timeline start time - YYYY-MM-DD
+    :param end_date: timeline end time - YYYY-MM-DD
+    :param export_path: export path to save output data
+    :param writer: CSVWriter / ParquetWriter object (output of get_writer)
+    :param viz: KeplerViz object, if passed will export Kepler with mobile_phone timeline
+    :param seed: if passed, the device is generated from its own random stream derived from (seed, mobile_id)
+    :param route_cache: RouteCache object shared between the generated devices
+    :param routing_index: RoutingIndex object of the graph
+    :param location_snaps: locations nearest edges lookup (output of get_location_snaps)
+    :param population: PopulationTimeline object, if passed the device home, work, residences and timeline are
+                       taken from it
+    :param drive_model: 'random' - 15-50 minutes drives, 'travel_time' - drives take the route travel time
+    :param edge_geometries: CompactGraph of graph to build routes geometries from (output of get_edge_geometries)
+    :param state_store: DeviceStateStore object, if passed the device state is saved to it
+    :param extend: if True, the device saved state is extended up to end_date (devices with no saved state are
+                   generated from start_date)
+    :param pipeline: WritePipeline object, if passed the device is written (and exported to Kepler) by its writer
+                     threads - day by day while it is generated, and while the next device is generated
+    :return:
+    """
+
+    state = state_store.load(mobile_id) if extend and state_store is not None else None
+
+    if state is not None:
+        mobile_phone = MobilePhone.from_state(state, graph, pois_df, route_cache=route_cache,
+                                              routing_index=routing_index, location_snaps=location_snaps,
+                                              edge_geometries=edge_geometries)
+        signals = mobile_phone.extend(end_date, drive_model=drive_model) # generate only the new days signals
+        if signals is None:
+            # already generated up to end_date, keep its files and state as they are
+            logging.info(f'mobile_phone {mobile_id} has no new days up to {end_date}, skipped')
+            return mobile_id
+
+    else:
+        mobile_phone = new_mobile_phone(mobile_id, graph, residence_df, pois_df, seed=seed, route_cache=route_cache,
+                                        routing_index=routing_index, location_snaps=location_snaps,
+                                        population=population, edge_geometries=edge_geometries)
+        signals = mobile_phone.iter_signals(start_date, end_date, drive_model=drive_model) # generate signals timeline
+
+    if viz is not None:
+        signals = list(signals)  # the map needs all the signals
+    timeline = mobile_phone.mobile_timeline
+
+    if pipeline is None:
+        write_device(mobile_id, signals, timeline, writer, viz, state_store, mobile_phone.state)
+    elif viz is not None:
+        pipeline.submit(write_device, mobile_id, signals, timeline, writer, viz, state_store, mobile_phone.state)
+    else:
+        stream = SignalsStream(pipeline)
+        pipeline.submit(write_device, mobile_id, stream, timeline, writer, None, state_store, mobile_phone.state)
+        stream.feed(signals)  # generate the signals day by day, the writer thread writes them as they come
+
+    logging.info(f'done generating mobile_phone {mobile_id} signals, routes cache: {mobile_phone.mobile_routs.stats()}')
+
+    return mobile_id
+
+
+def write_device(mobile_id, signals, timeline, writer, viz=None, state_store=None, state=None):
+
+    """
+    will save a generated mobile device - signals and timeline data, Kepler export and state. the state is saved only
+    once the device is written, so a failed write is regenerated (not skipped) by a later extend
+    :param mobile_id: unique int identifier of the mobile device
+    :param signals: signals chunks (output of MobilePhone.iter_signals / extend), streamed day by day to writer
+    :param timeline: timeline df (MobilePhone.mobile_timeline)
+    :param writer: CSVWriter / ParquetWriter object (output of get_writer)
+    :param viz: KeplerViz object, signals must then be a list of chunks
+    :param state_store: DeviceStateStore object
+    :param state: device state dict, or function that returns it (called once the signals are consumed)
+    :return:
+    """
+
+    writer.write(mobile_id, signals, timeline) # save signals and timeline data
+
+    if viz is not None and signals:
+        viz.add(mobile_id, pd.concat(signals, ignore_index=True), timeline)
+
+    if state_store is not None:
+        state_store.save(state() if callable(state) else state)
+
+
+def new_mobile_phone(mobile_id, graph, residence_df, pois_df, seed=None, route_cache=None, routing_index=None,
+                     location_snaps=None, population=None, edge_geometries=None):
+
+    """
+    will pick a new mobile device home, work and residences (or take them from population)
+    :return: MobilePhone object (see generate_mobile for params)
+    """
+
+    rng = mobile_rng(seed, mobile_id)  # same device -> same random stream, regardless of the worker running it
+
+    if population is not None:
+        home_info, work_info, mobile_residence_df, timeline = population.device(mobile_id)
+
+    else:
+        home_info = residence_df.sample(1, random_state=rng).to_dict(orient='records')[0] # pick random home location
+        work_info = pois_df.sample(1, random_state=rng).to_dict(orient='records')[0] # pick random work location
+
+        mobile_residence_df = residence_df[residence_df['BlockgroupID']!=home_info['BlockgroupID']].sample(10, random_state=rng) # pick 10 buildings from other block groups
+        timeline = None
+
+    mobile_phone = MobilePhone(mobile_id, graph, home_info, work_info, mobile_residence_df, pois_df,
+                               route_cache=route_cache, rng=rng, routing_index=routing_index,
+                               location_snaps=location_snaps, edge_geometries=edge_geometries) # initiate CellPhone object
+    if timeline is not None:
+        mobile_phone.mobile_timeline = timeline
+
+    return mobile_phone
+
+
+def init_worker(graph, residence_df, pois_df, routing_index, location_snaps, edge_geometries, population,
+                generate_kwargs, route_cache_kwargs, writer_kwargs, viz_kwargs=None, state_path=None, instrument=False,
+                profile=None, pipeline_kwargs=None):
+
+    """
+    pool initializer - keeps the read only graph and locations dfs in the worker process for all of its tasks
+    :param graph: MultiDiGraph object
+    :param residence_df: pandas df of residence locations
+    :param pois_df: pandas df of pois locations
+    :param routing_index: RoutingIndex object of the graph
+    :param location_snaps: locations nearest edges lookup (output of get_location_snaps)
+    :param edge_geometries: CompactGraph of graph to build routes geometries from (output of get_edge_geometries)
+    :param population: PopulationTimeline object
+    :param generate_kwargs: dict of the rest of generate_mobile params
+    :param route_cache_kwargs: get_route_cache params, each worker opens its own routes cache
+    :param writer_kwargs: get_writer params, each worker opens its own writer
+    :param viz_kwargs: KeplerViz params, if passed each worker opens its own KeplerViz
+    :param state_path: devices states sqlite file path, if passed each worker opens its own DeviceStateStore
+    :param instrument: if True, will record stages timing
+    :param profile: instrumentation.Profiler mode, each worker saves its own profile files
+    :param pipeline_kwargs: WritePipeline params, if passed each worker writes with its own writer threads
+    :return:
+    """
+
+    instrumentation.snapshot(reset=True)  # forked workers inherit the main process stages, report only their own
+    instrumentation.enable(instrument)
+    if profile:
+        profiler = instrumentation.Profiler(profile).start()
+        Finalize(profiler, stop_worker_profiler, args=(profiler, generate_kwargs['export_path']), exitpriority=5)
+
+    _WORKER_CONTEXT.update(graph=graph, residence_df=residence_df, pois_df=pois_df, routing_index=routing_index,
+                           location_snaps=location_snaps, edge_geometries=edge_geometries, population=population,
+                           route_cache=get_route_cache(**route_cache_kwargs), writer=get_writer(**writer_kwargs),
+                           viz=KeplerViz(**viz_kwargs) if viz_kwargs else None,
+                           state_store=DeviceStateStore(state_path) if state_path else None,
+                           pipeline=WritePipeline(**pipeline_kwargs) if pipeline_kwargs else None, **generate_kwargs)
+
+    # finish queued writes and flush buffered devices when the worker exits
+    Finalize(None, close_worker, args=(generate_kwargs['export_path'],), exitpriority=10)
+
+
+def run_worker(mobile_id):
+
+    """
+    pool task - generate a single mobile device using the worker context
+    :param mobile_id: unique int identifier of the mobile device
+    :return: mobile_id, worker pid, worker stages timing since last task and worker routes cache stats
+    """
+
+    mobile_id = generate_mobile(mobile_id, **_WORKER_CONTEXT)
+    _WORKER_CONTEXT['route_cache'].flush()
+    if _WORKER_CONTEXT['state_store'] is not None:
+        _WORKER_CONTEXT['state_store'].flush()
+
+    return mobile_id, os.getpid(), instrumentation.snapshot(reset=True), _WORKER_CONTEXT['route_cache'].stats()
+
+
+def close_worker(export_path):
+
+    """
+    worker exit - will finish the queued writes and close the worker pipeline, writer, viz and state store, then save
+    the worker stages timing since its last task and close errors to {export_path}/workers/{pid}.json, merged by the
+    main process (see merge_workers_close)
+    :param export_path: export path to save output data
+    :return:
+    """
+
+    errors = []
+    for name in ('pipeline', 'writer', 'viz', 'state_store'):  # writes are finished before the writer is closed
+        if _WORKER_CONTEXT.get(name) is not None:
+            try:
+                _WORKER_CONTEXT[name].close()
+            except Exception as e:
+                logging.exception(f'failed to close worker {name}')
+                errors.append(f'{name}: {e}')
+
+    with open(os.path.join(export_path, 'workers', f'{os.getpid()}.json'), 'w') as file:
+        json.dump({'stages': instrumentation.snapshot(reset=True), 'errors': errors}, file)
+
+
+def merge_workers_close(export_path):
+
+    """
+    will merge the workers stages timing since their last task (output of close_worker), and raise if any worker
+    failed to finish its writes
+    :param export_path: export path to save output data
+    :return:
+    """
+
+    errors = {}
+    for path in glob.glob(os.path.join(export_path, 'workers', '*.json')):
+        with open(path) as file:
+            worker = json.load(file)
+        instrumentation.merge(worker['stages'])
+        if worker['errors']:
+            errors[os.path.basename(path)[:-len('.json')]] = worker['errors']
+
+    shutil.rmtree(os.path.join(export_path, 'workers'), ignore_errors=True)
+
+    if errors:
+        raise RuntimeError(f'workers failed to finish their writes: {errors}')
+
+
+def stop_worker_profiler(profiler, export_path):
+
+    """
+    will save worker profile files - {pid}.prof (cProfile) and {pid}_memory.json (tracemalloc)
+    :param profiler: instrumentation.Profiler object
+    :param export_path: export path to save output data
+    :return:
+    """
+
+    memory = profiler.stop(export_path, name=f'worker_{os.getpid()}')
+    if memory:
+        with open(os.path.join(export_path, f'worker_{os.getpid()}_memory.json'), 'w') as file:
+            json.dump(memory, file, indent=2)
+
+
+def merge_cache_stats(caches_stats):
+
+    """
+    :param caches_stats: list of RouteCache.stats() dicts
+    :return: dict of total hits, misses and hit_rate
+    """
+
+    hits = sum(stats['hits'] for stats in caches_stats)
+    misses = sum(stats['misses'] for stats in caches_stats)
+
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+
+def main(lat, lng, radius, n_mobiles, start_date, end_date, export_path, kaggle_username, kaggle_key, graph=None,
+         viz_timeline=False, workers=1, seed=None, route_cache_path=None, route_cache_size=100000,
+         routing_index=False, snap_locations=True, output_format='csv', max_buffered_rows=1000000,
+         batch_timeline=False, building_store_path=None, poi_store_path=None, compact_graph_path=None,
+         drive_model='random', instrument=False, profile=None, resume=False, viz_mode='raw', viz_max_rows=100000,
+         viz_combined=False, bbox=None, first_mobile_id=0, state_path=None, extend=False, write_queue_size=8,
+         writer_threads=1, routing_cache_mb=512):
 
     """
     will generate signals timelines for n mobile devices (supports US only)
@@ -23,45 +301,182 @@ def main(lat, lng, radius, n_mobiles, start_date, end_date, export_path, kaggle_
     :param export_path: export path to save output data
     :param kaggle_username: your kaggle username
     :param kaggle_key: your kaggle key
-    :param graph: MultiDiGraph object
-    :param viz_timeline: if True, will export Kepler with mobile_phone timeline
+    :param graph: MultiDiGraph / CompactGraph object (CompactGraph implies routing_index)
+    :param viz_timeline: if True, will export Kepler with mobile_phone timeline to {export_path}/viz
+    :param workers: # of processes to shard the mobile devices across
+    :param seed: if passed, the output is reproducible and identical for any # of workers
+    :param route_cache_path: if passed, routes are cached in this sqlite file and reused between runs
+    :param route_cache_size: max # of routes to keep in memory (per worker)
+    :param routing_index: if True, will build a routing index of all residences and pois instead of taxicab routing
+    :param snap_locations: if True, will snap all residences and pois to their nearest edges once instead of per route
+    :param output_format: 'csv' - csv files per mobile device, 'parquet' - partitioned parquet datasets (a new run,
+                          not resume / extend, replaces the datasets of previous runs in export_path)
+    :param max_buffered_rows: max # of rows to buffer in memory before writing (per worker, parquet only)
+    :param batch_timeline: if True, will generate all mobile devices timelines at once with PopulationTimeline.
+                           devices homes, works and timelines then depend on the whole fleet (n_mobiles, first_mobile_id),
+                           so they are reproducible only by regenerating the same fleet (identical for any # of
+                           workers and on resume, but a devices range generated alone differs)
+    :param building_store_path: if passed, residences are queried from local building store instead of arcgis
+    :param poi_store_path: if passed, pois are queried from local pois store (built from kaggle on the first run)
+    :param compact_graph_path: if passed, will route on memory mapped CompactGraph arrays from this directory
+                               (exported from the osm graph on the first run), implies routing_index
+    :param drive_model: 'random' - 15-50 minutes drives, 'travel_time' - drives take the route travel time
+                        (with routing_index, routes minimize travel time)
+    :param instrument: if True, will save stages timing and routes cache stats to {export_path}/run_summary.json
+    :param profile: None / 'cprofile' / 'tracemalloc' / 'all' - will also capture profile of the run
+                    ({export_path}/main.prof, worker_{pid}.prof and memory stats)
+    :param resume: if True, will skip mobile devices recorded in {export_path}/manifest by a previous (interrupted)
+                   run with the same params, pass seed so the resumed output is identical to an uninterrupted run
+    :param viz_mode: 'raw' - signals, 'bins' - geohash bins of signals, 'drives' - simplified drives polylines
+    :param viz_max_rows: max # of signals rows per map
+    :param viz_combined: if True, all mobile devices are saved to a single map ({export_path}/viz/mobiles.html),
+                         viz_max_rows is split between the devices
+    :param bbox: (north, south, east, west) bounding box, if passed used instead of the lat, lng, radius box
+    :param first_mobile_id: mobile_ids are first_mobile_id..first_mobile_id+n_mobiles-1
+    :param state_path: if passed, devices states are saved to this sqlite file (to extend them in later runs)
+    :param extend: if True, devices saved in state_path are extended from their last generated day up to end_date,
+                   only the new days are generated (devices with no saved state are generated from start_date).
+                   csv files of the extension are saved with _{end_date} suffix
+    :param write_queue_size: max # of generated signals chunks (days) and devices queued for the background writer
+                             threads (per worker), the generation waits while the queue is full. 0 - write each
+                             device before generating the next
+    :param writer_threads: # of background writer threads (per worker)
+    :param routing_cache_mb: max memory of the routing index cached shortest path trees (per worker), each tree is
+                             8 bytes per graph node
     :return:
     """
 
+    run_start = time.perf_counter()
+    instrumentation.enable(instrument or bool(profile))
+    profiler = instrumentation.Profiler(profile).start()
+
     assert geohash.encode(lat, lng,2) in US_GEO_CELLS, f"function supports US only, {lat,lng} is out bounds"
+    assert not extend or state_path, "extend requires state_path"
+    assert not (extend and batch_timeline), "extend is not supported with batch_timeline"
+
+    if bbox is None:
+        bbox = bbox_from_point((lat, lng), radius)
+    residence_df = get_residence_df(bbox, building_store_path)
+    pois_df = get_kaggle_pois_data(kaggle_username, kaggle_key, export_path, bbox=bbox, poi_store_path=poi_store_path)
 
-    os.system(f'mkdir {export_path}/timelines')
-    os.system(f'mkdir {export_path}/signals')
-    if viz_timeline:
-        os.system(f'mkdir {export_path}/viz')
+    if compact_graph_path:
+        if not os.path.exists(compact_graph_path):
+            get_osmnx_graph(bbox, export_compact_path=compact_graph_path)
+        graph = load_compact_graph(compact_graph_path)
 
-    bbox = ox.utils_geo.bbox_from_point((lat, lng), radius)
-    residence_df = get_residence_df(bbox)
-    pois_df = get_kaggle_pois_data(kaggle_username, kaggle_key, export_path, bbox=bbox)
+    if isinstance(graph, CompactGraph):
+        routing_index = True  # CompactGraph is routed with routing index only
 
     if not graph:
         graph = get_osmnx_graph(bbox)
 
-    for i in range(0, n_mobiles):
+    routing_index = build_routing_index(graph, residence_df, pois_df,
+                                        weight='travel_time' if drive_model == 'travel_time' else 'length',
+                                        max_bytes=routing_cache_mb * 2 ** 20) \
+        if routing_index else None
+
+    location_snaps = None
+    if snap_locations and routing_index is None:  # routing index routes start and end at nodes, no edges to snap
+        residence_df = snap_to_edges(graph, residence_df)
+        pois_df = snap_to_edges(graph, pois_df)
+        location_snaps = get_location_snaps(residence_df, pois_df)
+
+    # routing index / compact graph have their own edges geometries arrays
+    edge_geometries = get_edge_geometries(graph) if routing_index is None else None
+
+    population = PopulationTimeline(residence_df, pois_df, n_mobiles, start_date, end_date, seed=seed,
+                                    first_mobile_id=first_mobile_id) \
+        if batch_timeline else None
 
-      home_info = residence_df.sample(1).to_dict(orient='records')[0] # pick random home location
-      work_info = pois_df.sample(1).to_dict(orient='records')[0] # pick random work location
+    manifest_path = os.path.join(export_path, 'manifest')
+    if resume:
+        completed = read_manifest(manifest_path)
+        if output_format == 'parquet':
+            remove_incomplete_parquet(export_path, manifest_path, completed)
+        logging.info(f'resuming run, {len(completed)} of {n_mobiles} mobile devices already completed')
+    else:
+        clear_manifest(manifest_path)
+        clear_viz_parts(export_path)
+        if output_format == 'parquet' and not extend:
+            # parquet files are uniquely named, files of a previous run would be kept next to the new ones
+            for name in ('signals', 'timelines'):
+                if os.path.exists(os.path.join(export_path, name)):
+                    shutil.rmtree(os.path.join(export_path, name))
+                    logging.info(f'removed previous run {name} parquet dataset from {export_path}')
+        completed = {}
+    mobile_ids = [i for i in range(first_mobile_id, first_mobile_id + n_mobiles) if i not in completed]
 
-      mobile_residence_df = residence_df[residence_df['BlockgroupID']!=home_info['BlockgroupID']].sample(10) # pick 10 buildings from other block groups
+    generate_kwargs = {'start_date': start_date, 'end_date': end_date, 'export_path': export_path,
+                       'seed': seed, 'drive_model': drive_model, 'extend': extend}
+    route_cache_kwargs = {'path': route_cache_path, 'max_size': route_cache_size,
+                          'routing': routing_key(routing_index is not None,
+                                                 routing_index.weight if routing_index is not None else 'length')}
+    writer_kwargs = {'export_path': export_path, 'output_format': output_format, 'manifest_path': manifest_path}
+    if output_format == 'parquet':
+        writer_kwargs['max_rows'] = max_buffered_rows
+    elif extend:
+        writer_kwargs['file_suffix'] = f'_{end_date}'  # keep the previous runs files
+    viz_kwargs = {'export_path': export_path, 'mode': viz_mode, 'combined': viz_combined,
+                  'max_rows': max(viz_max_rows // n_mobiles, 1) if viz_combined else viz_max_rows} \
+        if viz_timeline else None
+    pipeline_kwargs = {'max_queue': write_queue_size, 'n_threads': writer_threads} if write_queue_size > 0 else None
 
-      mobile_phone = MobilePhone(i, graph, home_info, work_info, mobile_residence_df, pois_df) # initiate CellPhone object
+    if workers > 1:
+        workers_cache_stats = {}
+        shutil.rmtree(os.path.join(export_path, 'workers'), ignore_errors=True)
+        os.makedirs(os.path.join(export_path, 'workers'))
+        with Pool(workers, initializer=init_worker,
+                  initargs=(graph, residence_df, pois_df, routing_index, location_snaps, edge_geometries, population,
+                            generate_kwargs, route_cache_kwargs, writer_kwargs, viz_kwargs, state_path,
+                            instrument or bool(profile), profile, pipeline_kwargs)) as pool:
+            for _, pid, stages, cache_stats in pool.imap_unordered(run_worker, mobile_ids,
+                                                                   chunksize=max(1, len(mobile_ids) // (workers * 4))):
+                instrumentation.merge(stages)
+                workers_cache_stats[pid] = cache_stats
+            pool.close()
+            pool.join()  # let workers exit gracefully, so their writers are flushed
+        merge_workers_close(export_path)
 
-      signals = mobile_phone.generate_signals_df(start_date, end_date) # generate signals timeline
-      signals.to_csv(os.path.join(f'{export_path}/signals', f'signals_{i}.csv'),index=False) # save signals data
+    else:
+        route_cache = get_route_cache(**route_cache_kwargs)
+        writer = get_writer(**writer_kwargs)
+        viz = KeplerViz(**viz_kwargs) if viz_kwargs else None
+        state_store = DeviceStateStore(state_path) if state_path else None
+        pipeline = WritePipeline(**pipeline_kwargs) if pipeline_kwargs else None
+        for i in mobile_ids:
+            generate_mobile(i, graph, residence_df, pois_df, writer=writer, viz=viz, state_store=state_store,
+                            route_cache=route_cache, pipeline=pipeline,
+                            routing_index=routing_index, location_snaps=location_snaps, population=population,
+                            edge_geometries=edge_geometries, **generate_kwargs)
+        if pipeline is not None:
+            pipeline.close()  # finish queued writes before the writer is closed
+        writer.close()
+        if viz is not None:
+            viz.close()
+        if state_store is not None:
+            state_store.close()
+        route_cache.flush()
+        workers_cache_stats = {os.getpid(): route_cache.stats()}
 
-      timeline = mobile_phone.mobile_timeline
-      timeline.to_csv(os.path.join(f'{export_path}/timelines', f'timeline_{i}.csv'),index=False) # save timeline data
+    if viz_timeline and viz_combined:
+        save_combined_viz(export_path)
 
-      if viz_timeline:
-          export_timeline_viz(signals, timeline, i , export_path)
+    cache_stats = merge_cache_stats(workers_cache_stats.values())
+    logging.info(f'routes cache: {cache_stats}')
 
-      logging.info(f'done generating mobile_phone {i} signals')
+    if pipeline_kwargs:
+        stages = instrumentation.snapshot()
+        logging.info(f'write pipeline: generation waited on full queue '
+                     f'{stages.get("pipeline_producer_wait", (0, 0.0))[1]:.1f} seconds, writer threads waited on '
+                     f'generation {stages.get("pipeline_writer_wait", (0, 0.0))[1]:.1f} seconds (all workers)')
 
+    memory = profiler.stop(export_path)
+    if instrument or profile:
+        run_seconds = time.perf_counter() - run_start
+        instrumentation.write_summary(os.path.join(export_path, 'run_summary.json'),
+                                      n_mobiles=n_mobiles, workers=workers, run_seconds=run_seconds,
+                                      mobiles_per_second=n_mobiles / run_seconds, route_cache=cache_stats,
+                                      memory=memory)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import os
+import json
+import glob
+import uuid
+import shutil
+import logging
+import threading
+
+
+class RunManifest:
+
+    def __init__(self, manifest_path, writer_id=None):
+
+        """
+        append only record of the mobile devices that were fully written, one jsonl file per writer
+        (so workers never write to the same file)
+        :param manifest_path: manifest directory
+        :param writer_id: unique identifier of the writer (its files prefix), the manifest file is named after it
+        """
+
+        os.makedirs(manifest_path, exist_ok=True)
+        self.path = os.path.join(manifest_path, f'{writer_id or uuid.uuid4().hex[:12]}.jsonl')
+        self.file = open(self.path, 'a')
+        self.lock = threading.Lock()  # writers may record from several writer threads (see pipeline.WritePipeline)
+
+    def record(self, mobile_id, output, signals_rows, timeline_rows):
+
+        """
+        will record a completed mobile device, must be called only after its outputs are on disk
+        :param mobile_id: unique identifier of the mobile device
+        :param output: output files (csv) / files prefix (parquet) of the mobile device
+        :param signals_rows: # of signals rows written
+        :param timeline_rows: # of timeline rows written
+        :return:
+        """
+
+        with self.lock:
+            self.file.write(json.dumps({'mobile_id': mobile_id, 'output': output, 'signals_rows': signals_rows,
+                                        'timeline_rows': timeline_rows}) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+
+        self.file.close()
+
+
+def read_manifest(manifest_path):
+
+    """
+    :param manifest_path: manifest directory
+    :return: dict of mobile_id -> manifest record of all completed mobile devices
+    """
+
+    completed = {}
+    for path in glob.glob(os.path.join(manifest_path, '*.jsonl')):
+        with open(path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partially written last line of a killed run
+                completed[record['mobile_id']] = record
+
+    return completed
+
+
+def clear_manifest(manifest_path):
+
+    """
+    :param manifest_path: manifest directory
+    :return:
+    """
+
+    shutil.rmtree(manifest_path, ignore_errors=True)
+
+
+def remove_incomplete_parquet(export_path, manifest_path, completed):
+
+    """
+    will delete parquet files that were written by the writers of an interrupted run but are not recorded in the
+    manifest, so resumed mobile devices are not duplicated (files of other runs, e.g. extended ones, are kept)
+    :param export_path: export path of the parquet datasets
+    :param manifest_path: manifest directory
+    :param completed: dict of completed mobile devices (output of read_manifest)
+    :return:
+    """
+
+    writer_ids = {os.path.basename(path)[:-len('.jsonl')]
+                  for path in glob.glob(os.path.join(manifest_path, '*.jsonl'))}
+    prefixes = {record['output'] for record in completed.values()}
+    removed = 0
+    for name in ('signals', 'timelines'):
+        for path in glob.glob(os.path.join(export_path, name, '**', '*.parquet'), recursive=True):
+            file_name = os.path.basename(path)
+            if file_name.split('-', 1)[0] in writer_ids and file_name.rsplit('-', 1)[0] not in prefixes:
+                os.remove(path)
+                removed += 1
+
+    if removed:
+        logging.info(f'removed {removed} parquet files of incomplete mobile devices')
@@ -0,0 +1,218 @@
+import time
+import queue
+import logging
+import threading
+
+import instrumentation
+
+_STOP = object()
+
+
+class StreamAborted(Exception):
+
+    pass
+
+
+class WritePipeline:
+
+    def __init__(self, max_queue=8, n_threads=1):
+
+        """
+        background writer threads - generation submits finished devices writes and moves on to the next device while
+        the writer threads serialize and flush them. devices signals are handed over day by day (see SignalsStream),
+        at most max_queue signals chunks are held in memory - generation blocks while the writers are behind
+        (backpressure)
+        :param max_queue: max # of queued devices writes, and of generated signals chunks not yet written
+        :param n_threads: # of writer threads (the submitted functions must then be thread safe)
+        """
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.budget = threading.BoundedSemaphore(max_queue)  # signals chunks in flight
+        self.max_queue = max_queue
+        self.error = None
+        self.n_tasks = 0
+        self.producer_wait = 0.0  # seconds generation was blocked on the writers
+        self.writer_wait = 0.0  # seconds writer threads were idle waiting on generation
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, name=f'writer-{i}', daemon=True) for i in range(n_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, func, *args):
+
+        """
+        will queue func(*args) to run on a writer thread
+        :param func: write function, e.g. main.write_device
+        :param args: func params (must not be changed by the caller after submit), SignalsStream params are fed by
+                     the caller after submit
+        :return:
+        """
+
+        self.raise_error()
+
+        start = time.perf_counter()
+        self.queue.put((func, args))
+        self.add_producer_wait(time.perf_counter() - start)
+
+    def add_producer_wait(self, seconds):
+
+        with self.lock:
+            self.producer_wait += seconds
+        instrumentation.record('pipeline_producer_wait', seconds)
+
+    def add_writer_wait(self, seconds):
+
+        with self.lock:
+            self.writer_wait += seconds
+        instrumentation.record('pipeline_writer_wait', seconds)
+
+    def run(self):
+
+        """
+        writer thread loop
+        :return:
+        """
+
+        while True:
+            start = time.perf_counter()
+            task = self.queue.get()
+            self.add_writer_wait(time.perf_counter() - start)
+
+            try:
+                if task is _STOP:
+                    return
+                func, args = task
+                if self.error is None:  # after a failure keep draining the queue, so generation never blocks forever
+                    func(*args)
+                    with self.lock:
+                        self.n_tasks += 1
+            except StreamAborted:
+                logging.info('background write aborted, the device generation failed')
+            except Exception as e:
+                logging.info(f'background write failed! reason: {e}')
+                self.error = e
+            finally:
+                if task is not _STOP:
+                    for arg in task[1]:
+                        if isinstance(arg, SignalsStream):
+                            arg.drain()
+                self.queue.task_done()
+
+    def join(self):
+
+        """
+        will wait for all the queued writes to finish
+        :return:
+        """
+
+        self.queue.join()
+        self.raise_error()
+
+    def raise_error(self):
+
+        if self.error is not None:
+            raise RuntimeError(f'background write failed: {self.error}') from self.error
+
+    def stats(self):
+
+        """
+        :return: dict of pipeline counters
+        """
+
+        return {'tasks': self.n_tasks, 'queued': self.queue.qsize(), 'max_queue': self.max_queue,
+                'threads': len(self.threads), 'producer_wait_seconds': round(self.producer_wait, 6),
+                'writer_wait_seconds': round(self.writer_wait, 6)}
+
+    def close(self):
+
+        """
+        will finish all the queued writes and stop the writer threads
+        :return:
+        """
+
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+
+        logging.info(f'write pipeline: {self.stats()}')
+        self.raise_error()
+
+
+class SignalsStream:
+
+    def __init__(self, pipeline):
+
+        """
+        signals chunks handed over from generation to a writer thread - iterated (once) by the writer as the chunks
+        are fed, so a device is written day by day while it is generated
+        :param pipeline: WritePipeline object, its budget bounds the chunks in flight
+        """
+
+        self.pipeline = pipeline
+        self.chunks = queue.Queue()
+        self.holding = False  # the writer holds a chunk of the budget
+        self.done = False
+        self.aborted = False
+
+    def feed(self, signals):
+
+        """
+        will generate signals (in the calling thread) and hand them to the writer chunk by chunk, blocks while the
+        pipeline budget of chunks in flight is used up
+        :param signals: iterable of signals dfs (output of MobilePhone.iter_signals / extend)
+        :return:
+        """
+
+        try:
+            for chunk in signals:
+                self.pipeline.raise_error()
+                start = time.perf_counter()
+                self.pipeline.budget.acquire()
+                self.pipeline.add_producer_wait(time.perf_counter() - start)
+                self.chunks.put(chunk)
+        except BaseException:
+            self.aborted = True  # the writer drops the device instead of recording a partial one
+            raise
+        finally:
+            self.chunks.put(_STOP)
+
+    def __iter__(self):
+
+        return self
+
+    def __next__(self):
+
+        if self.holding:  # the previous chunk is written
+            self.pipeline.budget.release()
+            self.holding = False
+
+        if self.done:
+            raise StopIteration
+
+        start = time.perf_counter()
+        chunk = self.chunks.get()
+        self.pipeline.add_writer_wait(time.perf_counter() - start)
+
+        if chunk is _STOP:
+            self.done = True
+            if self.aborted:
+                raise StreamAborted()
+            raise StopIteration
+
+        self.holding = True
+
+        return chunk
+
+    def drain(self):
+
+        """
+        will consume the rest of the stream (e.g. after a failed write), releasing its chunks budget
+        :return:
+        """
+
+        try:
+            for _ in self:
+                pass
+        except StreamAborted:
+            pass
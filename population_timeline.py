@@ -0,0 +1,210 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+
+TIMELINE_COLUMNS = ['mobile_id', 'stay_id', 'start_time', 'end_time', 'poi_id', 'poi_name', 'poi_type', 'lat', 'lng']
+
+
+def sample_population(residence_df, pois_df, n_mobiles, n_mobile_residences=10, rng=None):
+
+    """
+    will pick for each mobile device a home (residence_df position), work (pois_df position) and
+    n_mobile_residences distinct residences (residence_df positions) from other block groups than home
+    :param residence_df: pandas df of residence locations
+    :param pois_df: pandas df of pois locations
+    :param n_mobiles: # of mobile devices
+    :param n_mobile_residences: # of residences each mobile device may visit
+    :param rng: np.random.Generator
+    :return: home_idx (n_mobiles,), work_idx (n_mobiles,), residence_idx (n_mobiles, n_mobile_residences)
+    """
+
+    rng = rng if rng is not None else np.random.default_rng()
+
+    home_idx = rng.integers(0, len(residence_df), size=n_mobiles)
+    work_idx = rng.integers(0, len(pois_df), size=n_mobiles)
+
+    # residences sorted by block group, so the home block group is a contiguous range of positions to skip
+    block_groups = residence_df['BlockgroupID'].values
+    order = np.argsort(block_groups, kind='stable')
+    home_group = block_groups[home_idx]
+    group_start = np.searchsorted(block_groups[order], home_group, side='left')
+    group_size = np.searchsorted(block_groups[order], home_group, side='right') - group_start
+    n_candidates = len(residence_df) - group_size
+
+    assert (n_candidates >= n_mobile_residences).all(), \
+        f"not enough residences out of the home block group to pick {n_mobile_residences} residences"
+
+    picks = (rng.random((n_mobiles, n_mobile_residences)) * n_candidates[:, None]).astype(np.int64)
+    sorted_picks = np.sort(picks, axis=1)
+    for row in np.flatnonzero((sorted_picks[:, 1:] == sorted_picks[:, :-1]).any(axis=1)):
+        picks[row] = rng.choice(n_candidates[row], size=n_mobile_residences, replace=False)  # rare duplicates
+
+    picks = np.where(picks >= group_start[:, None], picks + group_size[:, None], picks)
+
+    return home_idx, work_idx, order[picks]
+
+
+@timed('population_timeline')
+def generate_population_timeline(residence_df, pois_df, home_idx, work_idx, residence_idx, start_date, end_date,
+                                 max_residences=2, max_pois=2, rng=None, mobile_ids=None):
+
+    """
+    vectorized version of MobilePhone.generate_mobile_timeline for many mobile devices and days at once.
+    stays are built as flat arrays of (mobile, day, slot) - home, work (working days), residences, pois, home
+    (pois are drawn with replacement per day, the chance of visiting the same poi twice in a day is negligible)
+
+    :param residence_df: pandas df of residence locations
+    :param pois_df: pandas df of pois locations
+    :param home_idx: array of home positions in residence_df (output of sample_population)
+    :param work_idx: array of work positions in pois_df (output of sample_population)
+    :param residence_idx: 2d array of residences positions in residence_df (output of sample_population)
+    :param start_date: format - YYYY-MM-DD
+    :param end_date: format - YYYY-MM-DD
+    :param max_residences: max residence locations to be visit in a given day
+    :param max_pois: max pois visits in a day
+    :param rng: np.random.Generator
+    :param mobile_ids: mobile_id of each mobile device, default 0..n-1
+    :return: timeline df of all mobile devices, ordered by mobile_id and stay_id
+    """
+
+    rng = rng if rng is not None else np.random.default_rng()
+    mobile_ids = np.arange(len(home_idx)) if mobile_ids is None else np.asarray(mobile_ids)
+
+    days = pd.date_range(start_date, end_date)
+    n_mobiles, n_days = len(home_idx), len(days)
+    n_cells = n_mobiles * n_days
+
+    # per (mobile, day) cell - mobile major, days ordered
+    cell_mobile = np.repeat(np.arange(n_mobiles), n_days)
+    cell_day = np.tile(np.arange(n_days), n_mobiles)
+    working_day = (np.asarray(days.weekday) < 5)[cell_day]
+
+    leaving_hour = rng.choice([6, 7, 8], size=n_cells)
+    working_hours = np.where(working_day, rng.choice([7, 8, 9], size=n_cells), 0)
+    n_residences = rng.integers(1, max_residences, size=n_cells)
+    n_pois = rng.integers(1, max_pois, size=n_cells)
+
+    n_visits = n_residences + n_pois
+    free_hour = leaving_hour + working_hours
+    hours_per_visit = (23 - free_hour) // n_visits  # leave 1 hour to stay at home at the end of the day
+    n_stays = 2 + working_day + n_visits
+
+    # per stay
+    cell = np.repeat(np.arange(n_cells), n_stays)
+    slot = np.arange(len(cell)) - np.repeat(np.cumsum(n_stays) - n_stays, n_stays)
+    visit = slot - 1 - working_day[cell]  # position among the day residences and pois visits
+
+    is_first = slot == 0
+    is_work = working_day[cell] & (slot == 1)
+    is_last = slot == n_stays[cell] - 1
+    is_residence = (visit >= 0) & (visit < n_residences[cell])
+    is_poi = (visit >= n_residences[cell]) & ~is_last
+
+    visit_start = free_hour[cell] + visit * hours_per_visit[cell]
+    start_hour = np.select([is_first, is_work, is_last],
+                           [0, leaving_hour[cell], free_hour[cell] + n_visits[cell] * hours_per_visit[cell]],
+                           visit_start)
+    end_hour = np.select([is_first, is_work, is_last],
+                         [leaving_hour[cell], free_hour[cell], 24],
+                         visit_start + hours_per_visit[cell])
+
+    day_start = days.values[cell_day[cell]]
+    stay_mobile = cell_mobile[cell]
+
+    lat, lng = np.empty(len(cell)), np.empty(len(cell))
+    poi_id, poi_name, poi_type = (np.empty(len(cell), dtype=object) for _ in range(3))
+
+    is_home = is_first | is_last
+    home_pos = home_idx[stay_mobile[is_home]]
+    lat[is_home], lng[is_home] = residence_df['lat'].values[home_pos], residence_df['lng'].values[home_pos]
+    poi_id[is_home], poi_name[is_home], poi_type[is_home] = 'home', 'home', 'home'
+
+    work_pos = work_idx[stay_mobile[is_work]]
+    lat[is_work], lng[is_work] = pois_df['lat'].values[work_pos], pois_df['lng'].values[work_pos]
+    poi_id[is_work], poi_name[is_work], poi_type[is_work] = 'work', 'work', 'work'
+
+    # distinct residences per day - random permutation of each mobile device residences
+    day_residences = np.argsort(rng.random((n_cells, residence_idx.shape[1]), dtype=np.float32),
+                                axis=1)[:, :max_residences - 1]
+    residence_pos = residence_idx[stay_mobile[is_residence],
+                                  day_residences[cell[is_residence], visit[is_residence]]]
+    lat[is_residence] = residence_df['lat'].values[residence_pos]
+    lng[is_residence] = residence_df['lng'].values[residence_pos]
+    poi_id[is_residence] = poi_name[is_residence] = residence_df.index.values[residence_pos]
+    poi_type[is_residence] = 'residence'
+
+    poi_pos = rng.integers(0, len(pois_df), size=is_poi.sum())
+    lat[is_poi], lng[is_poi] = pois_df['lat'].values[poi_pos], pois_df['lng'].values[poi_pos]
+    poi_id[is_poi] = pois_df.index.values[poi_pos]
+    poi_name[is_poi] = pois_df['poi_name'].values[poi_pos]
+    poi_type[is_poi] = 'store'
+
+    mobile_stays = n_stays.reshape(n_mobiles, n_days).sum(axis=1)
+    stay_id = np.arange(len(cell)) - np.repeat(np.cumsum(mobile_stays) - mobile_stays, mobile_stays)
+
+    return pd.DataFrame({'mobile_id': mobile_ids[stay_mobile],
+                         'stay_id': stay_id,
+                         'start_time': day_start + start_hour.astype('timedelta64[h]'),
+                         'end_time': day_start + end_hour.astype('timedelta64[h]'),
+                         'poi_id': poi_id,
+                         'poi_name': poi_name,
+                         'poi_type': poi_type,
+                         'lat': lat,
+                         'lng': lng}, columns=TIMELINE_COLUMNS)
+
+
+class PopulationTimeline:
+
+    def __init__(self, residence_df, pois_df, n_mobiles, start_date, end_date, max_residences=2, max_pois=2,
+                 n_mobile_residences=10, seed=None, first_mobile_id=0):
+
+        """
+        homes, works, residences and timelines of a whole fleet of mobile devices, generated at once. the fleet is
+        drawn from a single random stream, so a device depends on the whole fleet (seed, n_mobiles and its position),
+        not on (seed, mobile_id) only - unlike mobile_rng devices, a range of devices can't be regenerated alone
+        :param residence_df: pandas df of residence locations
+        :param pois_df: pandas df of pois locations
+        :param n_mobiles: # of mobile devices, mobile_ids are first_mobile_id..first_mobile_id+n_mobiles-1
+        :param start_date: format - YYYY-MM-DD
+        :param end_date: format - YYYY-MM-DD
+        :param max_residences: max residence locations to be visit in a given day
+        :param max_pois: max pois visits in a day
+        :param n_mobile_residences: # of residences each mobile device may visit
+        :param seed: random seed of the whole fleet
+        :param first_mobile_id: first mobile_id of the fleet
+        """
+
+        logging.info(f'generate population timeline of {n_mobiles} mobile devices - START')
+
+        rng = np.random.default_rng(seed)
+
+        self.residence_df = residence_df
+        self.pois_df = pois_df
+        self.first_mobile_id = first_mobile_id
+        self.home_idx, self.work_idx, self.residence_idx = sample_population(residence_df, pois_df, n_mobiles,
+                                                                             n_mobile_residences, rng)
+        self.timeline = generate_population_timeline(residence_df, pois_df, self.home_idx, self.work_idx,
+                                                     self.residence_idx, start_date, end_date,
+                                                     max_residences=max_residences, max_pois=max_pois, rng=rng)
+        mobile_stays = np.bincount(self.timeline['mobile_id'].values, minlength=n_mobiles)
+        self.offsets = np.concatenate([[0], np.cumsum(mobile_stays)])
+
+        logging.info(f'generate population timeline of {n_mobiles} mobile devices - END')
+
+    def device(self, mobile_id):
+
+        """
+        :param mobile_id: mobile device id
+        :return: home_info dict, work_info dict, mobile_residence_df and timeline df of the mobile device
+        """
+
+        mobile_id = mobile_id - self.first_mobile_id
+        home_info = self.residence_df.iloc[self.home_idx[mobile_id]].to_dict()
+        work_info = self.pois_df.iloc[self.work_idx[mobile_id]].to_dict()
+        mobile_residence_df = self.residence_df.iloc[self.residence_idx[mobile_id]]
+        timeline = self.timeline.iloc[self.offsets[mobile_id]:self.offsets[mobile_id + 1]] \
+            .drop(columns='mobile_id').reset_index(drop=True)
+
+        return home_info, work_info, mobile_residence_df, timeline
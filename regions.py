@@ -0,0 +1,156 @@
+import os
+import logging
+import warnings
+import itertools
+import fire
+import numpy as np
+from geolib import geohash
+
+from utils import get_osmnx_graph, load_compact_graph, bbox_from_point, US_GEO_CELLS, GEOHASH_BASE32
+from main import main
+
+
+class TileGraphStore:
+
+    def __init__(self, store_path):
+
+        """
+        road graphs of regions tiles - each tile graph is built once from osm and persisted as CompactGraph arrays in
+        {store_path}/{tile_id}. graphs are not kept in memory by the store, each region loads (memory maps) its graph
+        once for all its devices
+        :param store_path: tiles graphs directory
+        """
+
+        self.store_path = store_path
+        self.loads = 0
+        self.builds = 0
+        os.makedirs(store_path, exist_ok=True)
+
+    def get(self, tile_id, bbox):
+
+        """
+        :param tile_id: unique identifier of the tile
+        :param bbox: (north, south, east, west) bounding box of the tile
+        :return: CompactGraph object of the tile
+        """
+
+        path = os.path.join(self.store_path, tile_id)
+        if not os.path.exists(path):
+            get_osmnx_graph(bbox, export_compact_path=path)  # saved atomically, see CompactGraph.save
+            self.builds += 1
+
+        self.loads += 1
+
+        return load_compact_graph(path)
+
+    def stats(self):
+
+        """
+        :return: dict of store counters
+        """
+
+        return {'loads': self.loads, 'builds': self.builds}
+
+
+def geohash_coverage(prefixes, precision=5):
+
+    """
+    :param prefixes: list of geohash prefixes, each must start with one of US_GEO_CELLS
+    :param precision: tiles geohash # of characters
+    :return: list of all the geohash tiles of precision under prefixes
+    """
+
+    tiles = []
+    for prefix in prefixes:
+        assert prefix[:2] in US_GEO_CELLS, f'function supports US only, {prefix} is out of US_GEO_CELLS'
+        assert len(prefix) <= precision, f'prefix {prefix} is longer than precision {precision}'
+        tiles.extend(prefix + ''.join(chars) for chars in itertools.product(GEOHASH_BASE32,
+                                                                            repeat=precision - len(prefix)))
+
+    return sorted(set(tiles))
+
+
+def region_tiles(regions=None, geohash_prefixes=None, precision=5):
+
+    """
+    :param regions: list of (lat, lng, radius) regions
+    :param geohash_prefixes: list of geohash prefixes to cover with tiles (see geohash_coverage)
+    :param precision: tiles geohash # of characters
+    :return: list of (tile_id, bbox, lat, lng, radius) tuples
+    """
+
+    assert regions or geohash_prefixes, 'function must receive regions or geohash_prefixes'
+
+    tiles = []
+    for lat, lng, radius in regions or []:
+        tiles.append((f'{geohash.encode(lat, lng, 7)}_{int(radius)}',
+                      bbox_from_point((lat, lng), radius), lat, lng, radius))
+
+    for tile_id in geohash_coverage(geohash_prefixes or [], precision):
+        sw, ne = geohash.bounds(tile_id)
+        north, south, east, west = float(ne.lat), float(sw.lat), float(ne.lon), float(sw.lon)
+        lat, lng = (north + south) / 2, (east + west) / 2
+        radius = np.hypot((north - south) * 110540, (east - west) * 111320 * np.cos(np.radians(lat))) / 2
+        tiles.append((tile_id, (north, south, east, west), lat, lng, radius))
+
+    return tiles
+
+
+def main_regions(n_mobiles, start_date, end_date, export_path, kaggle_username, kaggle_key, regions=None,
+                 geohash_prefixes=None, precision=5, graph_store_path=None, poi_store_path=None,
+                 **kwargs):
+
+    """
+    will generate signals timelines for n mobile devices in each region (supports US only). devices are generated
+    region by region, each region graph is loaded once for all its devices. a failed region doesn't stop the
+    others, failed regions are raised at the end
+    :param n_mobiles: # of mobile devices to generate per region
+    :param start_date: timeline start time - YYYY-MM-DD
+    :param end_date: timeline end time - YYYY-MM-DD
+    :param export_path: export path to save output data, each region is saved to {export_path}/{tile_id}
+    :param kaggle_username: your kaggle username
+    :param kaggle_key: your kaggle key
+    :param regions: list of (lat, lng, radius) regions
+    :param geohash_prefixes: list of geohash prefixes, all their tiles of precision are generated
+    :param precision: tiles geohash # of characters (5 - ~4.9km x 4.9km tiles)
+    :param graph_store_path: tiles graphs directory, default - {export_path}/graphs
+    :param poi_store_path: pois store path shared by all regions, default - {export_path}/pois_store.parquet
+    :param kwargs: main params (workers, seed, output_format, ...)
+    :return: dict of tile_id -> first mobile_id of the region
+    """
+
+    tile_store = TileGraphStore(graph_store_path or os.path.join(export_path, 'graphs'))
+    poi_store_path = poi_store_path or os.path.join(export_path, 'pois_store.parquet')
+
+    first_mobile_ids = {}
+    failed = []
+    for i, (tile_id, bbox, lat, lng, radius) in enumerate(region_tiles(regions, geohash_prefixes, precision)):
+
+        logging.info(f'region {tile_id} - START')
+        region_path = os.path.join(export_path, tile_id)
+        os.makedirs(region_path, exist_ok=True)
+
+        try:
+            main(lat, lng, radius, n_mobiles, start_date, end_date, region_path, kaggle_username, kaggle_key,
+                 graph=tile_store.get(tile_id, bbox), poi_store_path=poi_store_path, bbox=bbox,
+                 first_mobile_id=i * n_mobiles, **kwargs)
+            first_mobile_ids[tile_id] = i * n_mobiles
+        except Exception:
+            logging.exception(f'failed to generate region {tile_id}!')
+            failed.append(tile_id)
+
+        logging.info(f'region {tile_id} - END, tiles graphs: {tile_store.stats()}')
+
+    if failed:
+        raise RuntimeError(f'failed to generate {len(failed)} of {len(first_mobile_ids) + len(failed)} regions: '
+                           f'{failed}, generated regions first mobile_ids: {first_mobile_ids}')
+
+    return first_mobile_ids
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.INFO)
+    warnings.filterwarnings('ignore')
+
+    fire.Fire(main_regions)
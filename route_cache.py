@@ -0,0 +1,201 @@
+import sqlite3
+import logging
+import numpy as np
+from collections import OrderedDict
+
+from shapely import wkb
+from shapely.geometry import LineString
+
+NO_ROUTE = 'no_rout'
+
+
+class RouteCache:
+
+    def __init__(self, max_size=100000):
+
+        """
+        in memory LRU cache of routes - (route coords array, travel time seconds) tuples, can be shared between
+        MobilePhone objects
+        :param max_size: max # of routes to keep in memory, the least recently used routes are evicted first
+        """
+
+        self.max_size = max_size
+        self.routes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+
+        """
+        will return the cached route (or NO_ROUTE) of key, None if not cached
+        :param key: ((lat, lng), (lat, lng)) tuple of origin and destination
+        :return:
+        """
+
+        route = self.routes.get(key)
+        if route is not None:
+            self.routes.move_to_end(key)
+            self.hits += 1
+            return route
+
+        route = self._load(key)
+        if route is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._remember(key, route)
+
+        return route
+
+    def __setitem__(self, key, route):
+
+        self._remember(key, route)
+        self._store(key, route)
+
+    def __contains__(self, key):
+
+        return key in self.routes
+
+    def __len__(self):
+
+        return len(self.routes)
+
+    def _remember(self, key, route):
+
+        self.routes[key] = route
+        self.routes.move_to_end(key)
+        while len(self.routes) > self.max_size:
+            self.routes.popitem(last=False)
+
+    def _load(self, key):
+
+        return None
+
+    def _store(self, key, route):
+
+        pass
+
+    def flush(self):
+
+        pass
+
+    def stats(self):
+
+        """
+        :return: dict of cache counters
+        """
+
+        lookups = self.hits + self.misses
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.routes)}
+
+
+class SQLiteRouteCache(RouteCache):
+
+    def __init__(self, path, max_size=100000, commit_every=100, routing='taxicab_length'):
+
+        """
+        LRU cache of routes backed by sqlite file, so routes survive between runs (geometries are stored as wkb)
+        (open one instance per process, sqlite connections can't be shared across a fork). the file is in WAL mode and
+        new routes are buffered in memory and inserted in one short transaction per flush, so workers sharing the file
+        never wait on each other's open transactions
+        :param path: sqlite file path
+        :param max_size: max # of routes to keep in memory
+        :param commit_every: # of new routes to buffer before writing them to disk
+        :param routing: routing backend and weight of the routes (see routing_key), each has its own table - routes of
+                        one backend / weight are never served to another
+        """
+
+        super().__init__(max_size)
+        self.path = path
+        self.commit_every = commit_every
+        self.pending = []  # new routes rows, not yet written
+        self.table = f'routes_{routing}'
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)  # autocommit, transactions are explicit
+        self.conn.execute('PRAGMA journal_mode=WAL')  # readers don't block on the writer
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} '
+                          '(orig_lat REAL, orig_lng REAL, dest_lat REAL, dest_lng REAL, geometry BLOB, travel_time REAL, '
+                          'PRIMARY KEY (orig_lat, orig_lng, dest_lat, dest_lng))')
+
+    def _load(self, key):
+
+        (orig_lat, orig_lng), (dest_lat, dest_lng) = key
+        try:
+            row = self.conn.execute(f'SELECT geometry, travel_time FROM {self.table} '
+                                    'WHERE orig_lat=? AND orig_lng=? AND dest_lat=? AND dest_lng=?',
+                                    (orig_lat, orig_lng, dest_lat, dest_lng)).fetchone()
+        except sqlite3.OperationalError as e:
+            logging.info(f'failed to read route from {self.path}, route will be calculated. reason: {e}')
+            return None
+
+        if row is None:
+            return None
+
+        if row[0] is None:
+            return NO_ROUTE
+
+        return np.asarray(wkb.loads(row[0]).coords)[:, :2], float('nan') if row[1] is None else row[1]
+
+    def _store(self, key, route):
+
+        (orig_lat, orig_lng), (dest_lat, dest_lng) = key
+        geometry, travel_time = (None, None) if route == NO_ROUTE else (wkb.dumps(LineString(route[0])), route[1])
+        self.pending.append((orig_lat, orig_lng, dest_lat, dest_lng, geometry, travel_time))
+        if len(self.pending) >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+
+        """
+        write buffered routes to disk, in a single short transaction
+        :return:
+        """
+
+        if not self.pending:
+            return
+
+        try:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                self.conn.executemany(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+            self.pending = []
+        except sqlite3.OperationalError as e:
+            logging.info(f'failed to commit routes to {self.path}, will retry on next flush. reason: {e}')
+
+    def close(self):
+
+        self.flush()
+        self.conn.close()
+
+
+def routing_key(routing_index=None, weight='length'):
+
+    """
+    :param routing_index: if True, routes are calculated with RoutingIndex, otherwise with taxicab
+    :param weight: RoutingIndex edge attribute to minimize - 'length' / 'travel_time' (taxicab minimizes length)
+    :return: routing backend and weight identifier, e.g. 'index_travel_time'
+    """
+
+    assert weight in ('length', 'travel_time'), f"weight should be 'length' or 'travel_time', got {weight}"
+
+    return f'index_{weight}' if routing_index else 'taxicab_length'
+
+
+def get_route_cache(path=None, max_size=100000, routing='taxicab_length'):
+
+    """
+    will return in memory route cache, or sqlite backed one if path is passed
+    :param path: sqlite file path
+    :param max_size: max # of routes to keep in memory
+    :param routing: routing backend and weight of the cached routes (output of routing_key)
+    :return:
+    """
+
+    if path:
+        return SQLiteRouteCache(path, max_size=max_size, routing=routing)
+
+    return RouteCache(max_size=max_size)
@@ -0,0 +1,161 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from compact_graph import CompactGraph
+from instrumentation import timed
+
+
+class RoutingIndex:
+
+    def __init__(self, G, locations_dfs, weight='length', max_sources=None, max_bytes=512 * 2 ** 20):
+
+        """
+        routing index for the known stay locations of a graph. all locations are snapped once to their nearest node
+        and shortest paths are served from cached single source dijkstra trees (computed on CSR arrays),
+        so after warm up a route query is a walk over a predecessors array
+        :param G: MultiDiGraph / CompactGraph object
+        :param locations_dfs: list of pandas dfs with lat, lng columns (residence_df, pois_df)
+        :param weight: edge attribute to minimize - 'length' / 'travel_time'
+        :param max_sources: max # of source trees to keep in memory, least recently used are evicted first
+        :param max_bytes: max memory of the kept source trees (per process) - each tree is 8 bytes per graph node
+                          (float32 distances, int32 predecessors), e.g. 512MB keeps ~670 trees of a 100k nodes graph
+        """
+
+        from scipy.spatial import cKDTree
+
+        self.weight = weight
+        self.graph = G if isinstance(G, CompactGraph) else CompactGraph.from_networkx(G)
+        self.nodes = self.graph.node_ids
+        self.max_sources = int(max(1, min(max_sources or np.inf, max_bytes // (8 * max(len(self.nodes), 1)))))
+        self.csgraph = self.graph.csgraph(weight)
+
+        self.lat_scale = np.cos(np.radians(np.mean(self.graph.node_y))) if len(self.nodes) else 1.0
+        self.kdtree = cKDTree(np.column_stack([self.graph.node_x * self.lat_scale, self.graph.node_y]))
+
+        self.location_nodes = {}
+        for locations_df in locations_dfs:
+            self.snap(locations_df['lat'].values, locations_df['lng'].values)
+
+        self.trees = OrderedDict()
+
+        logging.info(f'routing index - {len(self.location_nodes)} locations snapped to '
+                     f'{len(set(self.location_nodes.values()))} nodes')
+
+    def snap(self, lats, lngs):
+
+        """
+        will return the nearest node index of each location (and remember it for the next queries)
+        :param lats: array of latitudes
+        :param lngs: array of longitudes
+        :return:
+        """
+
+        lats, lngs = np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)
+        _, node_indexes = self.kdtree.query(np.column_stack([lngs * self.lat_scale, lats]))
+        self.location_nodes.update(zip(zip(lats.tolist(), lngs.tolist()), node_indexes.tolist()))
+
+        return node_indexes
+
+    def nearest_node(self, location):
+
+        """
+        :param location: lat,lng tuple
+        :return: nearest node index
+        """
+
+        node_index = self.location_nodes.get(location)
+        if node_index is None:
+            node_index = int(self.snap([location[0]], [location[1]])[0])
+
+        return node_index
+
+    def source_tree(self, source):
+
+        """
+        will return the distances and predecessors arrays of source, computing it if not cached
+        :param source: node index
+        :return:
+        """
+
+        tree = self.trees.get(source)
+        if tree is None:
+            from scipy.sparse.csgraph import dijkstra
+
+            distances, predecessors = dijkstra(self.csgraph, indices=source, return_predecessors=True)
+            tree = (distances.astype(np.float32), predecessors.astype(np.int32))
+            self.trees[source] = tree
+            while len(self.trees) > self.max_sources:
+                self.trees.popitem(last=False)
+        else:
+            self.trees.move_to_end(source)
+
+        return tree
+
+    def precompute(self, batch_size=256):
+
+        """
+        will compute the source trees of all snapped locations with batched multi source dijkstra
+        :param batch_size: # of sources per dijkstra call
+        :return:
+        """
+
+        from scipy.sparse.csgraph import dijkstra
+
+        sources = [i for i in sorted(set(self.location_nodes.values())) if i not in self.trees]
+        for i in range(0, len(sources), batch_size):
+            batch = sources[i:i + batch_size]
+            distances, predecessors = dijkstra(self.csgraph, indices=batch, return_predecessors=True)
+            for source, dist_row, pred_row in zip(batch, distances, predecessors):
+                self.trees[source] = (dist_row.astype(np.float32), pred_row.astype(np.int32))
+            while len(self.trees) > self.max_sources:
+                self.trees.popitem(last=False)
+
+    def shortest_path(self, orig, dest):
+
+        """
+        taxicab.distance.shortest_path compatible route between two locations (snapped to nodes, no partial edges)
+        :param orig: lat,lng tuple of origin location
+        :param dest: lat,lng tuple of destination location
+        :return: (route length, list of node ids, None, None)
+        """
+
+        source, target = self.nearest_node(orig), self.nearest_node(dest)
+        distances, predecessors = self.source_tree(source)
+
+        if not np.isfinite(distances[target]):
+            import networkx as nx
+
+            raise nx.NetworkXNoPath(f'no path between {orig} and {dest}')
+
+        path = [target]
+        while path[-1] != source:
+            path.append(predecessors[path[-1]])
+
+        return float(distances[target]), self.nodes[path[::-1]].tolist(), None, None
+
+
+@timed('routing_index_build')
+def build_routing_index(G, residence_df, pois_df, weight='length', precompute=False, max_bytes=512 * 2 ** 20):
+
+    """
+    will build RoutingIndex for the graph and all residence / pois locations
+    :param G: MultiDiGraph / CompactGraph object
+    :param residence_df: pandas df of residence locations
+    :param pois_df: pandas df of pois locations
+    :param weight: edge attribute to minimize - 'length' / 'travel_time'
+    :param precompute: if True, will compute all locations source trees upfront
+    :param max_bytes: max memory of the cached source trees, per process (see RoutingIndex)
+    :return:
+    """
+
+    logging.info('build routing index - START')
+
+    routing_index = RoutingIndex(G, [residence_df, pois_df], weight=weight, max_bytes=max_bytes)
+    if precompute:
+        routing_index.precompute()
+
+    logging.info('build routing index - END')
+
+    return routing_index
@@ -0,0 +1,109 @@
+import json
+import asyncio
+import numpy as np
+from aiohttp import web
+
+from arcgis_fetch import FeatureServerFetcher, split_envelope
+
+MAX_RECORD_COUNT = 10
+BBOX = (30.36, 30.34, -97.72, -97.74)
+
+
+def features():
+
+    """
+    :return: list of (object id, lat, lng) - spread points, plus a dense cluster that quadrant splits can't break
+             below the server record limit
+    """
+
+    rng = np.random.default_rng(0)
+    ymax, ymin, xmax, xmin = BBOX
+    points = list(zip(rng.uniform(ymin, ymax, 60), rng.uniform(xmin, xmax, 60)))
+    points += [(30.3512345, -97.7387654)] * 35
+
+    return [(oid, lat, lng) for oid, (lat, lng) in enumerate(points)]
+
+
+def esri_feature(oid, lat, lng, size=0.00001):
+
+    ring = [[lng, lat], [lng, lat + size], [lng + size, lat + size], [lng + size, lat], [lng, lat]]  # clockwise
+
+    return {'attributes': {'OBJECTID': oid}, 'geometry': {'rings': [ring]}}
+
+
+class MockFeatureServer:
+
+    def __init__(self):
+
+        """
+        FeatureServer query endpoint with a record limit, returnCountOnly and resultOffset paging. the first request
+        fails with 503 to exercise the retries
+        """
+
+        self.features = features()
+        self.requests = []
+
+    async def query(self, request):
+
+        self.requests.append(dict(request.query))
+        if len(self.requests) == 1:
+            return web.Response(status=503)
+
+        envelope = json.loads(request.query['geometry'])
+        matches = [feature for feature in self.features
+                   if envelope['ymin'] <= feature[1] <= envelope['ymax'] and
+                   envelope['xmin'] <= feature[2] <= envelope['xmax']]
+
+        if request.query.get('returnCountOnly') == 'true':
+            return web.json_response({'count': len(matches)})
+
+        if 'resultOffset' in request.query:
+            offset = int(request.query['resultOffset'])
+            count = min(int(request.query['resultRecordCount']), MAX_RECORD_COUNT)
+            page = sorted(matches)[offset:offset + count]
+            return web.json_response({'objectIdFieldName': 'OBJECTID', 'features': [esri_feature(*f) for f in page]})
+
+        return web.json_response({'objectIdFieldName': 'OBJECTID',
+                                  'exceededTransferLimit': len(matches) > MAX_RECORD_COUNT,
+                                  'features': [esri_feature(*f) for f in matches[:MAX_RECORD_COUNT]]})
+
+
+async def fetch(server, **kwargs):
+
+    app = web.Application()
+    app.router.add_get('/query', server.query)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    try:
+        url = f'http://127.0.0.1:{port}/query?f=json&geometry=' \
+              '{"ymax":%s,"ymin":%s,"xmax":%s,"xmin":%s}'
+        return await FeatureServerFetcher(url, backoff=0.01, **kwargs).fetch_features(BBOX)
+    finally:
+        await runner.cleanup()
+
+
+def test_split_envelope_covers_bbox():
+
+    quadrants = split_envelope(BBOX)
+
+    assert len(quadrants) == 4
+    assert max(q[0] for q in quadrants) == BBOX[0] and min(q[1] for q in quadrants) == BBOX[1]
+    assert max(q[2] for q in quadrants) == BBOX[2] and min(q[3] for q in quadrants) == BBOX[3]
+
+
+def test_fetch_splits_and_pages_past_record_limit():
+
+    server = MockFeatureServer()
+    fetched = asyncio.run(fetch(server, max_depth=2, page_size=MAX_RECORD_COUNT))
+
+    assert sorted(feature['attributes']['OBJECTID'] for feature in fetched) == [f[0] for f in server.features]
+    assert len(server.requests) > 2  # the bbox was split to quadrants
+    assert any(request.get('returnCountOnly') == 'true' for request in server.requests)
+    assert sum('resultOffset' in request for request in server.requests) >= 4  # the cluster was paged
+
+    gdf = FeatureServerFetcher.to_geodataframe(fetched)
+    assert len(gdf) == len(server.features) and gdf['geometry'].notna().all()
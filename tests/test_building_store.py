@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+from grid_store import CELL_SIZE, write_grid_store, read_grid_store
+from building_store import build_building_store, query_building_store
+
+# bboxes (ymax, ymin, xmax, xmin) within a single cell, across cells rows / columns and covering all the points
+BBOXES = [(30.3545, 30.3515, -97.7315, -97.7345),
+          (30.3620, 30.3380, -97.7190, -97.7460),
+          (30.3705, 30.3310, -97.7105, -97.7530),
+          (30.4000, 30.3000, -97.7000, -97.8000)]
+
+
+def brute_force(df, bbox):
+
+    ymax, ymin, xmax, xmin = bbox
+
+    return df[df['lat'].between(ymin, ymax) & df['lng'].between(xmin, xmax)]
+
+
+def test_read_grid_store_matches_brute_force(tmp_path):
+
+    rng = np.random.default_rng(0)
+    n = 5000
+    df = pd.DataFrame({'id': np.arange(n),
+                       'lat': rng.uniform(30.35 - 2 * CELL_SIZE, 30.35 + 2 * CELL_SIZE, n),
+                       'lng': rng.uniform(-97.73 - 2 * CELL_SIZE, -97.73 + 2 * CELL_SIZE, n)})
+    store_path = str(tmp_path / 'store.parquet')
+    write_grid_store(df, store_path, row_group_size=100)  # many row groups, so the filters skip most of them
+
+    for bbox in BBOXES:
+        result = read_grid_store(store_path, bbox)
+        assert 'cell' not in result.columns
+        assert sorted(result['id']) == sorted(brute_force(df, bbox)['id'])
+
+
+def test_query_building_store_matches_brute_force(tmp_path):
+
+    rng = np.random.default_rng(1)
+    n = 500
+    lat = rng.uniform(30.35 - 2 * CELL_SIZE, 30.35 + 2 * CELL_SIZE, n)
+    lng = rng.uniform(-97.73 - 2 * CELL_SIZE, -97.73 + 2 * CELL_SIZE, n)
+    footprints = gpd.GeoDataFrame(geometry=[box(x - 0.00005, y - 0.00005, x + 0.00005, y + 0.00005)
+                                            for x, y in zip(lng, lat)], crs='EPSG:4326')
+    footprints_path = str(tmp_path / 'footprints.geojson')
+    footprints.to_file(footprints_path, driver='GeoJSON')
+
+    store_path = str(tmp_path / 'buildings.parquet')
+    build_building_store(footprints_path, store_path)
+
+    centroids = pd.DataFrame({'OBJECTID': np.arange(n), 'lat': footprints.centroid.y, 'lng': footprints.centroid.x})
+    for bbox in BBOXES:
+        buildings_df = query_building_store(store_path, bbox)
+        assert isinstance(buildings_df, gpd.GeoDataFrame)
+        assert sorted(buildings_df['OBJECTID']) == sorted(brute_force(centroids, bbox)['OBJECTID'])
@@ -0,0 +1,39 @@
+import pandas as pd
+
+from main import generate_mobile
+from routing_index import RoutingIndex
+from device_state import DeviceStateStore
+from writers import get_writer
+from benchmarks.fixtures import grid_bbox, synthetic_graph, synthetic_residence_df, synthetic_pois_df
+
+
+def test_extend_without_new_days_keeps_files_and_state(tmp_path):
+
+    graph = synthetic_graph(n_rows=10, n_cols=10)
+    bbox = grid_bbox(n_rows=10, n_cols=10)
+    residence_df = synthetic_residence_df(bbox, 200)
+    pois_df = synthetic_pois_df(bbox, 50)
+    routing_index = RoutingIndex(graph, [residence_df, pois_df])
+    state_store = DeviceStateStore(str(tmp_path / 'devices.sqlite'))
+
+    def run(end_date, extend):
+        writer = get_writer(str(tmp_path), file_suffix=f'_{end_date}' if extend else '')
+        generate_mobile(0, graph, residence_df, pois_df, '2022-01-03', end_date, str(tmp_path), writer, seed=0,
+                        routing_index=routing_index, state_store=state_store, extend=extend)
+        writer.close()
+        state_store.flush()
+
+    run('2022-01-03', extend=False)
+    run('2022-01-04', extend=True)
+
+    signals_path = tmp_path / 'signals' / 'signals_0_2022-01-04.csv'
+    timeline_path = tmp_path / 'timelines' / 'timeline_0_2022-01-04.csv'
+    signals, timeline, state = pd.read_csv(signals_path), pd.read_csv(timeline_path), state_store.load(0)
+
+    run('2022-01-04', extend=True)  # same end_date again - no new days
+
+    pd.testing.assert_frame_equal(pd.read_csv(signals_path), signals)
+    pd.testing.assert_frame_equal(pd.read_csv(timeline_path), timeline)
+    assert state_store.load(0) == state
+
+    state_store.close()
@@ -0,0 +1,67 @@
+import os
+import filecmp
+from multiprocessing import Pool
+
+from main import generate_mobile, init_worker, run_worker, merge_workers_close
+from route_cache import RouteCache
+from routing_index import RoutingIndex
+from writers import get_writer
+from benchmarks.fixtures import grid_bbox, synthetic_graph, synthetic_residence_df, synthetic_pois_df
+
+START_DATE, END_DATE = '2022-01-03', '2022-01-05'
+MOBILE_IDS = list(range(8))
+
+
+def fixtures():
+
+    graph = synthetic_graph(n_rows=10, n_cols=10)
+    bbox = grid_bbox(n_rows=10, n_cols=10)
+    residence_df = synthetic_residence_df(bbox, 200)
+    pois_df = synthetic_pois_df(bbox, 50)
+
+    return graph, residence_df, pois_df, RoutingIndex(graph, [residence_df, pois_df])
+
+
+def run_serial(export_path, graph, residence_df, pois_df, routing_index):
+
+    writer = get_writer(export_path)
+    route_cache = RouteCache()
+    for mobile_id in MOBILE_IDS:
+        generate_mobile(mobile_id, graph, residence_df, pois_df, START_DATE, END_DATE, export_path, writer, seed=7,
+                        route_cache=route_cache, routing_index=routing_index)
+    writer.close()
+
+
+def run_workers(export_path, graph, residence_df, pois_df, routing_index, workers=3):
+
+    generate_kwargs = {'start_date': START_DATE, 'end_date': END_DATE, 'export_path': export_path, 'seed': 7,
+                       'drive_model': 'random', 'extend': False}
+    route_cache_kwargs = {'path': None, 'max_size': 5}  # small caches, routes are evicted and recalculated
+    writer_kwargs = {'export_path': export_path, 'output_format': 'csv'}
+    pipeline_kwargs = {'max_queue': 2, 'n_threads': 1}
+
+    os.makedirs(os.path.join(export_path, 'workers'))
+    with Pool(workers, initializer=init_worker,
+              initargs=(graph, residence_df, pois_df, routing_index, None, None, None, generate_kwargs,
+                        route_cache_kwargs, writer_kwargs, None, None, False, None, pipeline_kwargs)) as pool:
+        list(pool.imap_unordered(run_worker, MOBILE_IDS[::-1], chunksize=1))  # other order than the serial run
+        pool.close()
+        pool.join()
+    merge_workers_close(export_path)
+
+
+def test_workers_output_identical_to_serial_run(tmp_path):
+
+    graph, residence_df, pois_df, routing_index = fixtures()
+    serial_path, workers_path = str(tmp_path / 'serial'), str(tmp_path / 'workers')
+
+    run_serial(serial_path, graph, residence_df, pois_df, routing_index)
+    run_workers(workers_path, graph, residence_df, pois_df, routing_index)
+
+    for name in ('signals', 'timelines'):
+        files = sorted(os.listdir(os.path.join(serial_path, name)))
+        assert files == sorted(os.listdir(os.path.join(workers_path, name)))
+        assert len(files) == len(MOBILE_IDS)
+        _, mismatch, errors = filecmp.cmpfiles(os.path.join(serial_path, name), os.path.join(workers_path, name),
+                                               files, shallow=False)
+        assert not mismatch and not errors
@@ -1,38 +1,158 @@
 import pandas as pd
 import numpy as np
 import logging
-from datetime import timedelta
-import taxicab as tc
+from datetime import datetime, timedelta
 
-from shapely.geometry import LineString, Point, MultiLineString
-from shapely.ops import transform, linemerge, nearest_points, snap
+from shapely.geometry import Point
+from shapely.ops import nearest_points
+
+from route_cache import RouteCache, NO_ROUTE
+from compact_graph import CompactGraph
+from instrumentation import timed, timed_stage
+
+# position of the route nodes in a taxicab route tuple (taxicab.constants.BODY). taxicab imports osmnx, so it is
+# imported only when routing without a routing index
+BODY = 1
+
+
+def line_measure(coords):
+
+    """
+    will return the cumulative length of a line at each of its coordinates, normalized to 0-1
+    :param coords: (n, 2) array of line coordinates
+    :return:
+    """
+
+    measure = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(coords, axis=0).T))])
+
+    return measure / measure[-1] if measure[-1] > 0 else np.linspace(0, 1, len(coords))
+
+
+def interpolate_line(coords, measure, positions):
+
+    """
+    will return the x, y arrays of the points located at positions along the line
+    :param coords: (n, 2) array of line coordinates
+    :param measure: non decreasing array of the line measure (length, travel time) at each coordinate
+    :param positions: array of measure values to locate
+    :return:
+    """
+
+    return np.interp(positions, measure, coords[:, 0]), np.interp(positions, measure, coords[:, 1])
+
+
+def line_length_meters(coords):
+
+    """
+    approximate (equirectangular) length of a line in meters
+    :param coords: (n, 2) array of lng, lat coords
+    :return:
+    """
+
+    deltas = np.diff(coords, axis=0)
+    lat_scale = np.cos(np.radians(coords[:, 1].mean())) if len(coords) else 1.0
+
+    return float(np.hypot(deltas[:, 0] * 111320 * lat_scale, deltas[:, 1] * 110540).sum())
+
+
+def orient_line(coords, start):
+
+    """
+    :param coords: (n, 2) array of line coordinates
+    :param start: (2,) coordinate the line should start from
+    :return: coords, flipped if its end is closer to start than its beginning
+    """
+
+    return coords[::-1] if np.hypot(*(coords[-1] - start)) < np.hypot(*(coords[0] - start)) else coords
+
+
+def json_record(record):
+
+    """
+    :param record: dict (e.g. df row)
+    :return: json serializable copy of record - timestamps as iso strings, numpy scalars as python scalars,
+             other objects (e.g. geometries) are dropped
+    """
+
+    if record is None:
+        return None
+
+    values = {}
+    for key, value in record.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        if value is None or isinstance(value, (str, int, float, bool)):
+            values[str(key)] = value
+
+    return values
+
+
+def mobile_rng(seed, mobile_id):
+
+    """
+    will return independent random generator of a mobile device - the mobile_id child of the seed SeedSequence,
+    so any device can be regenerated alone, on any worker and in any order
+    :param seed: fleet random seed, if None will return unseeded generator
+    :param mobile_id: int identifier of the mobile device
+    :return: np.random.Generator
+    """
+
+    if seed is None:
+        return np.random.default_rng()
+
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int(mobile_id),)))
 
 
 class MobilePhone:
 
-    def __init__(self, mobile_id, graph, home_info, work_info, mobile_residence_df, pois_df):
+    def __init__(self, mobile_id, graph, home_info, work_info, mobile_residence_df, pois_df, route_cache=None,
+                 rng=None, routing_index=None, location_snaps=None, edge_geometries=None):
 
         """
         :param mobile_id: unique str / float/ int identifier of the mobile device
-        :param graph: MultiDiGraph objects
+        :param graph: MultiDiGraph / CompactGraph object (CompactGraph requires routing_index)
         :param home_info: # home info dict
         :param work_info: # work info dict
         :param mobile_residence_df: pandas df of residence locations
         :param pois_df: pandas df of pois locations
+        :param route_cache: RouteCache object to share routes between devices, if None routes are cached per device
+        :param rng: np.random.Generator of the mobile device (see mobile_rng), if None will use unseeded generator
+        :param routing_index: RoutingIndex object of the graph, if None routes are calculated with taxicab
+        :param location_snaps: dict of lat,lng -> (nearest edge, snapped lat,lng) (output of utils.get_location_snaps)
+        :param edge_geometries: CompactGraph of graph, routes geometries are concatenated from its edges coords arrays
+                                (not needed with CompactGraph / routing_index, if None edges are read from graph)
         """
 
+        assert routing_index is not None or not isinstance(graph, CompactGraph), \
+            "CompactGraph can be routed only with routing_index"
+
         self.G = graph
         self.mobile_id = mobile_id
-        self.mobile_type = np.random.choice(['iOS', 'Android'])
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.mobile_type = self.rng.choice(['iOS', 'Android'])
         self.home_info = home_info
         self.work_info = work_info
         self.mobile_residence_df = mobile_residence_df
         self.pois_df = pois_df
         self.mobile_timeline = pd.DataFrame()
-        self.mobile_routs = {}
+        self.mobile_routs = route_cache if route_cache is not None else RouteCache()
         self.mobile_signals = None
+        self.routing_index = routing_index
+        self.location_snaps = location_snaps if location_snaps is not None else {}
+        self.last_stay = None  # last timeline stay, its signals are generated with the next stays (see extend)
+        self.drive_end = None  # end of the drive to the last stay
+
+        if isinstance(graph, CompactGraph):
+            self.edge_geometries = graph
+        elif routing_index is not None:
+            self.edge_geometries = routing_index.graph
+        else:
+            self.edge_geometries = edge_geometries
 
-    def generate_signals_df(self, start_date, end_date, max_residences=2, max_pois=2):
+    @timed('signals_df')
+    def generate_signals_df(self, start_date, end_date, max_residences=2, max_pois=2, drive_model='random'):
 
         """
         function will build signals timeline based on the output of generate_mobile_timeline
@@ -40,81 +160,264 @@ class MobilePhone:
         :param end_date: format - YYYY-MM-DD
         :param max_residences: max residence locations to be visit in a given day
         :param max_pois: max pois visits in a day
+        :param drive_model: 'random' - 15-50 minutes drives, 'travel_time' - drives take the route travel time
         :return:
         """
 
-        signals_dfs = []
+        self.mobile_signals = pd.concat(list(self.iter_signals(start_date, end_date, max_residences=max_residences,
+                                                               max_pois=max_pois, drive_model=drive_model)),
+                                        ignore_index=True)
+
+        return self.mobile_signals
+
+    def iter_signals(self, start_date, end_date, max_residences=2, max_pois=2, drive_model='random'):
+
+        """
+        function will yield the signals timeline (same as generate_signals_df) in time ordered chunks, one per
+        timeline day, so long timelines can be consumed with bounded memory. the timeline is generated on call
+        :param start_date: format - YYYY-MM-DD
+        :param end_date: format - YYYY-MM-DD
+        :param max_residences: max residence locations to be visit in a given day
+        :param max_pois: max pois visits in a day
+        :param drive_model: 'random' - 15-50 minutes drives, 'travel_time' - drives take the route travel time
+        :return: generator of signals dfs
+        """
 
         if self.mobile_timeline.empty:
             self.generate_mobile_timeline(start_date, end_date, max_residences=max_residences, max_pois=max_pois)
 
-        drive_end = None
+        return self._signals_chunks(drive_model, self.mobile_timeline)
+
+    def extend(self, end_date, max_residences=2, max_pois=2, drive_model='random'):
+
+        """
+        function will continue the mobile device timeline from its last generated day up to end_date - only the new
+        days are generated, starting with the signals of the previous last stay (e.g. restored with from_state)
+        :param end_date: format - YYYY-MM-DD
+        :param max_residences: max residence locations to be visit in a given day
+        :param max_pois: max pois visits in a day
+        :param drive_model: 'random' - 15-50 minutes drives, 'travel_time' - drives take the route travel time
+        :return: generator of the new signals dfs (see iter_signals), mobile_timeline is set to the new stays.
+                 None if end_date adds no new days (the device is already generated up to end_date)
+        """
+
+        assert self.last_stay is not None, 'mobile device has no generated timeline to extend'
+
+        first_day = pd.Timestamp(self.last_stay['start_time']).normalize() + timedelta(days=1)
+        if first_day > pd.Timestamp(end_date):
+            self.mobile_timeline = pd.DataFrame(columns=list(self.last_stay))
+            return None
+
+        self.generate_mobile_timeline(first_day, end_date, max_residences=max_residences, max_pois=max_pois)
+        self.mobile_timeline['stay_id'] += int(self.last_stay['stay_id']) + 1
+
+        timeline = pd.concat([pd.DataFrame([self.last_stay]), self.mobile_timeline], ignore_index=True)
+
+        return self._signals_chunks(drive_model, timeline, self.drive_end)
+
+    def _signals_chunks(self, drive_model, timeline, drive_end=None):
+
+        """
+        generator of iter_signals - walks the timeline stays and yields each day signals once the next day started,
+        after its last signal lat2, lng2 are set to the next day first signal
+        :param drive_model: 'random' - 15-50 minutes drives, 'travel_time' - drives take the route travel time
+        :param timeline: timeline df to walk
+        :param drive_end: end of the drive to the first stay, if None the first stay signals start at its start time
+        :return:
+        """
+
+        signals_dfs = []
+        day = None
+        pending = None  # last day signals, waiting for the next signal location
+
         # build all routs
-        for row in self.mobile_timeline \
-                .join(self.mobile_timeline[['lat', 'lng']].shift(-1), lsuffix='_orig', rsuffix='_dest') \
+        for row in timeline \
+                .join(timeline[['lat', 'lng']].shift(-1), lsuffix='_orig', rsuffix='_dest') \
                 .dropna(subset=['lat_orig', 'lng_orig', 'lat_dest', 'lng_dest'], how='any').itertuples():
 
+            if day is not None and row.start_time.date() != day:
+                chunk = self.signals_chunk(signals_dfs)
+                signals_dfs = []
+                if not chunk.empty:
+                    if pending is not None:
+                        yield self.link_chunks(pending, chunk)
+                    pending = chunk
+            day = row.start_time.date()
+
             if not drive_end:
                 drive_end = row.start_time
 
             static_signals = self.generate_static_signals(row.lat_orig, row.lng_orig, drive_end, row.end_time)
             signals_dfs.append(static_signals)
 
-            self.calc_route((row.lat_orig, row.lng_orig), (row.lat_dest, row.lng_dest))
-            route_geo = self.mobile_routs.get(((row.lat_orig, row.lng_orig), (row.lat_dest, row.lng_dest)))
+            route = self.calc_route((row.lat_orig, row.lng_orig), (row.lat_dest, row.lng_dest))
 
-            if route_geo != 'no_rout':
+            if route != NO_ROUTE:
 
-                drive_signals, drive_end = self.generate_route_signals(route_geo, row.end_time, 45)
+                route_coords, travel_time = route
+                drive_seconds = travel_time if drive_model == 'travel_time' and np.isfinite(travel_time) else None
+                drive_signals, drive_end = self.generate_route_signals(route_coords, row.end_time, 45,
+                                                                       drive_seconds=drive_seconds)
                 signals_dfs.append(drive_signals)
 
             else:
                 drive_end = row.end_time
 
-        self.mobile_signals = pd.concat(signals_dfs, ignore_index=True) \
-            .sort_values('timestamp')
-        self.mobile_signals['mobile_type'] = self.mobile_type
-        self.mobile_signals['mobile_id'] = self.mobile_id
+        chunk = self.signals_chunk(signals_dfs) if signals_dfs else None
+        if chunk is not None and not chunk.empty:
+            if pending is not None:
+                yield self.link_chunks(pending, chunk)
+            pending = chunk
 
-        self.mobile_signals = self.mobile_signals.join(self.mobile_signals[['lat', 'lng']].shift(-1), lsuffix='1',
-                                                       rsuffix='2')
+        if len(timeline):
+            self.last_stay = timeline.iloc[-1].to_dict()
+            self.drive_end = drive_end
 
-        return self.mobile_signals
+        if pending is not None:
+            yield pending
+
+    def signals_chunk(self, signals_dfs):
+
+        """
+        will merge stays and drives signals to a time ordered chunk with the output columns, lat2, lng2 of the last
+        signal are left empty
+        :param signals_dfs: list of signals dfs (output of generate_static_signals / generate_route_signals)
+        :return:
+        """
+
+        chunk = pd.concat(signals_dfs, ignore_index=True).sort_values('timestamp', ignore_index=True)
+        chunk['mobile_type'] = self.mobile_type
+        chunk['mobile_id'] = self.mobile_id
+
+        return chunk.join(chunk[['lat', 'lng']].shift(-1), lsuffix='1', rsuffix='2')
+
+    @staticmethod
+    def link_chunks(chunk, next_chunk):
 
+        """
+        :param chunk: signals chunk (output of signals_chunk)
+        :param next_chunk: the following signals chunk
+        :return: chunk with its last signal lat2, lng2 set to the first signal of next_chunk
+        """
+
+        chunk.loc[chunk.index[-1], ['lat2', 'lng2']] = next_chunk[['lat1', 'lng1']].iloc[0].values
+
+        return chunk
+
+    def state(self):
+
+        """
+        :return: json serializable dict of the mobile device state - home, work, residences, mobile_type, last stay
+                 and random generator state, to continue its timeline later (see from_state, extend)
+        """
+
+        residences = self.mobile_residence_df[['lat', 'lng']].rename_axis('index').reset_index()
+
+        return {'mobile_id': json_record({'mobile_id': self.mobile_id})['mobile_id'],
+                'mobile_type': str(self.mobile_type),
+                'home_info': json_record(self.home_info),
+                'work_info': json_record(self.work_info),
+                'residences': [json_record(residence) for residence in residences.to_dict(orient='records')],
+                'last_stay': json_record(self.last_stay),
+                'drive_end': self.drive_end.isoformat() if self.drive_end is not None else None,
+                'rng_state': self.rng.bit_generator.state}
+
+    @classmethod
+    def from_state(cls, state, graph, pois_df, route_cache=None, routing_index=None, location_snaps=None,
+                   edge_geometries=None):
+
+        """
+        will restore mobile device from its state (output of state), ready to extend
+        :param state: mobile device state dict
+        :param graph: MultiDiGraph / CompactGraph object
+        :param pois_df: pandas df of pois locations
+        :return: MobilePhone object (see __init__ for the rest of params)
+        """
+
+        mobile_residence_df = pd.DataFrame(state['residences']).set_index('index').rename_axis(None)
+
+        mobile_phone = cls(state['mobile_id'], graph, state['home_info'], state['work_info'], mobile_residence_df,
+                           pois_df, route_cache=route_cache, routing_index=routing_index,
+                           location_snaps=location_snaps, edge_geometries=edge_geometries)
+        mobile_phone.rng.bit_generator.state = state['rng_state']
+        mobile_phone.mobile_type = state['mobile_type']
+
+        if state['last_stay'] is not None:
+            mobile_phone.last_stay = dict(state['last_stay'], start_time=pd.Timestamp(state['last_stay']['start_time']),
+                                          end_time=pd.Timestamp(state['last_stay']['end_time']))
+        if state['drive_end'] is not None:
+            mobile_phone.drive_end = pd.Timestamp(state['drive_end'])
+
+        return mobile_phone
+
+    @timed('calc_route')
     def calc_route(self, orig, dest):
         """
-        will try to get route from mobile_routs. if not exists will calculate using get_route_geometry
+        will try to get route from mobile_routs. if not exists will calculate using get_route_geometry.
+        routes are cached and calculated in one canonical direction (lower location first) and reversed on read, so a
+        route never depends on which direction an earlier device (sharing the cache) requested first
         :param orig: lat,lng tuple of origin location
         :param dest: lat,lng tuple of destination location
-        :return:
+        :return: (route coords, travel time seconds) tuple, or NO_ROUTE if route could not be created
         """
-        if not self.mobile_routs.get((orig, dest)):
+        if dest < orig:
+            route_info = self.calc_route(dest, orig)
+            return route_info if route_info == NO_ROUTE else (route_info[0][::-1], route_info[1])
+
+        route_info = self.mobile_routs.get((orig, dest))
+        if route_info is None:
             try:
-                route = tc.distance.shortest_path(self.G, orig, dest)
-                route_geo = self.get_route_geometry(route, orig, dest)
-                self.mobile_routs[(orig, dest)] = route_geo
-                self.mobile_routs[(dest, orig)] = self.reverse_geom(route_geo)
+                orig_edge, orig_snap = self.location_snaps.get(orig, (None, None))
+                dest_edge, dest_snap = self.location_snaps.get(dest, (None, None))
+                with timed_stage('shortest_path'):
+                    if self.routing_index is not None:
+                        route = self.routing_index.shortest_path(orig, dest)
+                    else:
+                        import taxicab as tc
+                        route = tc.distance.shortest_path(self.G, orig, dest, orig_edge=orig_edge,
+                                                          dest_edge=dest_edge)
+                route_coords = self.get_route_geometry(route, orig, dest, orig_snap, dest_snap)
+                travel_time = self.get_route_travel_time(route, route_coords)
+                route_info = (route_coords, travel_time)
             except Exception as e:
                 logging.info(f'faild to create route! {orig} -> {dest} reason: {e}')
-                self.mobile_routs[(orig, dest)] = 'no_rout'
-                self.mobile_routs[(dest, orig)] = 'no_rout'
+                route_info = NO_ROUTE
 
+            # cache errors are not route errors, keep them out of the try
+            self.mobile_routs[(orig, dest)] = route_info
 
-    def reverse_geom(self, geom):
+        return route_info
+
+    def get_route_travel_time(self, route, route_coords):
 
         """
-        will reverse linestring geometry
-        :param geom: linestring object
-        :return:
+        function that returns the route travel time - the sum of the route edges travel_time, extended to the
+        partial edges and the connections to the origin and destination at the route average speed
+        :param route: route (output of taxicab shortest_path)
+        :param route_coords: route coords (output of get_route_geometry)
+        :return: travel time seconds, nan if graph has no travel times
         """
-        def _reverse(x, y, z=None):
-            if z:
-                return x[::-1], y[::-1], z[::-1]
-            return x[::-1], y[::-1]
 
-        return transform(_reverse, geom)
+        nodes = route[BODY]
+
+        if self.edge_geometries is not None:
+            edges = self.edge_geometries.path_edges(nodes)
+            edges_seconds = self.edge_geometries.travel_time[edges].sum()
+            edges_meters = self.edge_geometries.length[edges].sum()
+
+        else:
+            # if there are parallel edges, select the shortest in length (same as get_route_geometry)
+            edges_data = [min(self.G.get_edge_data(u, v).values(), key=lambda d: d["length"])
+                          for u, v in zip(nodes[:-1], nodes[1:])]
+            edges_seconds = sum(data.get('travel_time', np.nan) for data in edges_data)
+            edges_meters = sum(data['length'] for data in edges_data)
+
+        if not edges_meters > 0:
+            return np.nan
 
+        return float(edges_seconds * line_length_meters(route_coords) / edges_meters)
 
+    @timed('static_signals')
     def generate_static_signals(self, lat, lng, start_time, end_time, sampling_rate=600):
         """
         function that returns location and timestamps nearby the selected location
@@ -126,120 +429,137 @@ class MobilePhone:
         :return:
         """
 
-        signals_list = []
-        signal_time = start_time + timedelta(
-            seconds=int(np.random.choice([5, 10, 15])))  # start sample couple of second after stay start
-
         noise_list = np.linspace(0.9999997, 1.000003)  # noise factor
 
-        while end_time > signal_time:
-            signals_list.append({'lat': lat * np.random.choice(noise_list),
-                                 'lng': lng * np.random.choice(noise_list),
-                                 'timestamp': signal_time})
-            signal_time += timedelta(seconds=sampling_rate -
-                                             int(np.random.choice(range(0, 59))))
+        stay_seconds = (end_time - start_time).total_seconds()
+        max_signals = max(int(stay_seconds // max(sampling_rate - 58, 1)), 0) + 1  # all intervals at their shortest
 
-        return pd.DataFrame(signals_list).sort_values('timestamp')
+        # start sample couple of second after stay start, then every sampling_rate minus 0-58 seconds
+        intervals = sampling_rate - self.rng.integers(0, 59, size=max_signals)
+        intervals[0] = self.rng.choice([5, 10, 15])
+        offsets = np.cumsum(intervals)
+        offsets = offsets[offsets < stay_seconds]
 
+        return pd.DataFrame({'lat': lat * self.rng.choice(noise_list, size=len(offsets)),
+                             'lng': lng * self.rng.choice(noise_list, size=len(offsets)),
+                             'timestamp': pd.Timestamp(start_time).to_datetime64() + offsets.astype('timedelta64[s]')})
 
-    def generate_route_signals(self, route_geo, start_time, sampling_rate=45, points_per_segment=10):
+
+    @timed('route_signals')
+    def generate_route_signals(self, route_coords, start_time, sampling_rate=45, points_per_segment=10,
+                               drive_seconds=None):
 
         """
-        function that get route linestring and returns signals with timestamps upon this line
-        :param route_geo: linestring object (output of get_route_geometry)
+        function that get route coords and returns signals with timestamps upon this line
+        :param route_coords: (n, 2) array of lng, lat coords (output of get_route_geometry)
         :param start_time: format YYYY-MM-DD
         :param sampling_rate: time diff between each two signals in seconds
-        :param points_per_segment: will signals out of n random points
+        :param points_per_segment: max # of signals per line segment
+        :param drive_seconds: drive duration (route travel time), if None the drive takes random 15-50 minutes
         :return:
         """
 
-        end_time = start_time + timedelta(minutes=int(np.random.choice(range(15, 50))))
+        coords = np.asarray(route_coords)
 
-        n_points = round((end_time - start_time).total_seconds() / sampling_rate)
+        if drive_seconds is None:
+            n_points = round(60 * int(self.rng.integers(15, 50)) / sampling_rate)  # 15-50 minutes drive
+            n_signals = min(n_points, points_per_segment * (len(coords) - 1))
 
-        noise_list = np.linspace(0.9999999, 1.000001)  # add noise to points
-        signal_time = start_time - timedelta(seconds=int(np.random.choice([5, 10, 15])))
+            # start sample couple of seconds before drive start, then every sampling_rate plus 0-8 seconds
+            intervals = sampling_rate + self.rng.integers(0, 9, size=n_points + 1)
+            intervals[0] = -self.rng.choice([5, 10, 15])
+            offsets = np.cumsum(intervals)
+            drive_end = start_time + timedelta(seconds=int(offsets[-1]))
 
-        timestamps_list = []
+            offsets = offsets[:n_signals]
+            positions = np.sort(self.rng.uniform(0, 1, size=n_signals))
 
-        for i in range(0, n_points):
-            timestamps_list.append(signal_time)
-            signal_time += timedelta(seconds=sampling_rate + int(np.random.choice(range(0, 9))))
+        else:
+            # exactly the signals that fit the drive - every sampling_rate plus 0-8 seconds, each located where the
+            # drive is at its time (route average speed)
+            drive_seconds = max(int(round(drive_seconds)), 1)
+            max_signals = drive_seconds // sampling_rate + 1  # all intervals at their shortest
+
+            intervals = sampling_rate + self.rng.integers(0, 9, size=max_signals)
+            intervals[0] = self.rng.choice([5, 10, 15])  # start sample couple of seconds after drive start
+            offsets = np.cumsum(intervals)
+            offsets = offsets[offsets < drive_seconds]
+            n_signals = len(offsets)
+            drive_end = start_time + timedelta(seconds=drive_seconds)
 
-        line_to_points = np.array(
-            [
-                {'lat': y * np.random.choice(noise_list), 'lng': x * np.random.choice(noise_list)}
-                for p1, p2 in zip(route_geo.coords, route_geo.coords[1:])  # iterate through line segments
-                for x, y in zip(
-                np.linspace(p1[0], p2[0], points_per_segment),
-                np.linspace(p1[1], p2[1], points_per_segment),
-            )
-            ])
+            positions = offsets / drive_seconds
 
-        indexes = np.sort(np.random.choice(range(0, len(line_to_points)), replace=False,
-                                           size=min(n_points, len(line_to_points))))
-        random_points = line_to_points[indexes]
+        lng, lat = interpolate_line(coords, line_measure(coords), positions)
 
-        signals_df = pd.DataFrame([i for i in random_points])
-        signals_df['timestamp'] = timestamps_list[:len(signals_df)]
+        noise_list = np.linspace(0.9999999, 1.000001)  # add noise to points
+        signals_df = pd.DataFrame({'lat': lat * self.rng.choice(noise_list, size=n_signals),
+                                   'lng': lng * self.rng.choice(noise_list, size=n_signals),
+                                   'timestamp': pd.Timestamp(start_time).to_datetime64() +
+                                                offsets.astype('timedelta64[s]')})
 
-        return signals_df, signal_time
+        return signals_df, drive_end
 
-    def get_route_geometry(self, route, orig, dest):
+    @timed('route_geometry')
+    def get_route_geometry(self, route, orig, dest, orig_snap=None, dest_snap=None):
 
         """
-        function that get's taxicab shortest_path and returns liststring object
+        function that get's taxicab shortest_path and returns the route coords - origin, partial origin edge,
+        route edges, partial destination edge and destination
         :param route: route (output of taxicab shortest_path)
         :param orig: lat,lng tuple of origin location
         :param dest: lat,lng tuple of destination location
-        :return:
+        :param orig_snap: lat,lng tuple of origin location snapped to its edge, if None will be searched
+        :param dest_snap: lat,lng tuple of destination location snapped to its edge, if None will be searched
+        :return: (n, 2) array of lng, lat coords
         """
 
-        x, y = [], []
-        for u, v in zip(route[tc.constants.BODY][:-1], route[tc.constants.BODY][1:]):
-            # if there are parallel edges, select the shortest in length
-            data = min(self.G.get_edge_data(u, v).values(), key=lambda d: d["length"])
-            if "geometry" in data:
-                # if geometry attribute exists, add all its coords to list
-                xs, ys = data["geometry"].xy
-                x.extend(xs)
-                y.extend(ys)
-            else:
-                # otherwise, the edge is a straight line from node to node
-                x.extend((self.G.nodes[u]["x"], self.G.nodes[v]["x"]))
-                y.extend((self.G.nodes[u]["y"], self.G.nodes[v]["y"]))
-
-        final_route = []
+        parts = [np.array([[orig[1], orig[0]]])]
 
         if route[2]:
+            orig_point = np.array([orig_snap[1], orig_snap[0]]) if orig_snap else \
+                np.asarray(nearest_points(Point(orig[1], orig[0]), route[2])[1].coords)[0, :2]
+            parts.append(orig_point[None])
+            parts.append(orient_line(np.asarray(route[2].coords)[:, :2], orig_point))
 
-            final_route.append(LineString([Point(orig[1], orig[0]),
-                                           nearest_points(Point(orig[1], orig[0]), route[2])[1]]))
-            final_route.append(route[2])
+        parts.append(self.get_route_coords(route[BODY]))
 
-        else:
-            final_route.append(LineString([Point(orig[1], orig[0]), Point(x[0], y[0])]))
+        if route[3]:
+            dest_point = np.array([dest_snap[1], dest_snap[0]]) if dest_snap else \
+                np.asarray(nearest_points(Point(dest[1], dest[0]), route[3])[1].coords)[0, :2]
+            parts.append(orient_line(np.asarray(route[3].coords)[:, :2], dest_point)[::-1])
+            parts.append(dest_point[None])
 
-        final_route.append(LineString([Point(lng, lat) for lng, lat in list(zip(x, y))]))
+        parts.append(np.array([[dest[1], dest[0]]]))
 
-        if route[3]:
-            final_route.append(route[3])
-            final_route.append(LineString([nearest_points(Point(dest[1], dest[0]), route[3])[1],
-                                           Point(dest[1], dest[0])]))
+        coords = np.concatenate(parts)
+        # drop repeated coords where the parts meet
+        keep = np.concatenate([[True], (np.diff(coords, axis=0) != 0).any(axis=1)])
 
-        else:
-            final_route.append(LineString([Point(x[-1], y[-1]),
-                                           Point(dest[1], dest[0])]))
+        return coords[keep]
+
+    def get_route_coords(self, nodes):
+
+        """
+        :param nodes: list of route node ids
+        :return: (n, 2) array of lng, lat coords of the route edges
+        """
 
-        final_route_geo = linemerge(final_route)
-        if isinstance(final_route_geo, MultiLineString):
-            final_route_geo = linemerge([snap(i, j, 0.000001) for i, j in zip(final_route, final_route[1:])])
-            if isinstance(final_route_geo, MultiLineString):
-                final_route_geo = list(final_route_geo)[
-                    np.argmax(np.array([len(i.coords) for i in list(final_route_geo)]))]
+        if self.edge_geometries is not None:
+            return self.edge_geometries.path_coords(nodes)
+
+        coords = [np.array([[self.G.nodes[node]['x'], self.G.nodes[node]['y']] for node in nodes[:1]]).reshape(-1, 2)]
+        for u, v in zip(nodes[:-1], nodes[1:]):
+            # if there are parallel edges, select the shortest in length
+            data = min(self.G.get_edge_data(u, v).values(), key=lambda d: d["length"])
+            if "geometry" in data:
+                coords.append(np.asarray(data["geometry"].coords)[:, :2])
+            else:
+                # otherwise, the edge is a straight line from node to node
+                coords.append(np.array([[self.G.nodes[v]["x"], self.G.nodes[v]["y"]]]))
 
-        return final_route_geo
+        return np.concatenate(coords)
 
+    @timed('mobile_timeline')
     def generate_mobile_timeline(self, start_time, end_time, max_residences, max_pois):
 
         """
@@ -258,10 +578,10 @@ class MobilePhone:
         stays_counter = 0
         for day in pd.date_range(start_time, end_time):
 
-            n_residences = np.random.choice(range(1, max_residences))
-            n_pois = np.random.choice(range(1, max_pois))
+            n_residences = self.rng.choice(range(1, max_residences))
+            n_pois = self.rng.choice(range(1, max_pois))
 
-            levaing_hour = np.random.choice([6, 7, 8])
+            levaing_hour = self.rng.choice([6, 7, 8])
             start_time = day
             end_time = day + timedelta(hours=int(levaing_hour))
 
@@ -276,7 +596,7 @@ class MobilePhone:
             stays_counter += 1
 
             if day.weekday() not in [5, 6]:  # if working day
-                working_hours = np.random.choice([7, 8, 9])
+                working_hours = self.rng.choice([7, 8, 9])
                 start_time = end_time
                 end_time += timedelta(hours=int(working_hours))
 
@@ -296,7 +616,7 @@ class MobilePhone:
                 time_per_stay = np.floor(time_left / (n_residences + n_pois))
 
                 if n_residences != 0:
-                    for row in self.mobile_residence_df.sample(n_residences).itertuples():
+                    for row in self.mobile_residence_df.sample(n_residences, random_state=self.rng).itertuples():
                         start_time = end_time
                         end_time += timedelta(hours=int(time_per_stay))
                         time_left -= time_per_stay
@@ -312,7 +632,7 @@ class MobilePhone:
                         stays_counter += 1
 
                 if n_pois != 0:
-                    for row in self.pois_df.sample(n_pois).itertuples():
+                    for row in self.pois_df.sample(n_pois, random_state=self.rng).itertuples():
                         start_time = end_time
                         end_time += timedelta(hours=int(time_per_stay))
                         time_left -= time_per_stay
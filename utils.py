@@ -1,15 +1,18 @@
 import os
 import json
 import datetime
+import functools
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-import osmnx as ox
-import networkx as nx
-from shapely.geometry import Point
 import logging
-from keplergl import KeplerGl
 
-ox.config(use_cache=True, log_console=True)
+from compact_graph import CompactGraph
+from instrumentation import timed
+
+# heavy dependencies (osmnx, networkx, geopandas, keplergl, aiohttp) are imported by the functions that use them,
+# so generating on a pre built graph doesn't pay for importing them
+
+EARTH_RADIUS_M = 6371009
 
 ARCGIS_REST_URL = 'https://services.arcgis.com/P3ePLMYs2RVChkJx/ArcGIS/rest/services/MSBFP2/FeatureServer/0/query?f=json&returnGeometry=true&spatialRel=esriSpatialRelIntersects&geometry={"ymax":%s,"ymin":%s,"xmax":%s,"xmin":%s,"spatialReference":{"wkid":4326}}&geometryType=esriGeometryEnvelope&outSR=4326'
 
@@ -22,18 +25,66 @@ US_GEO_CELLS = (
     "b4"
 )
 
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
 
-def get_residence_df(bbox):
 
+@functools.lru_cache()
+def import_osmnx():
+
+    """
+    will import and configure osmnx on first use
+    :return: osmnx module
     """
-    get bbox and return pandas df of buildings locations (the query returns maximum of 2000 records)
+
+    import osmnx as ox
+    ox.config(use_cache=True, log_console=True)
+
+    return ox
+
+
+def bbox_from_point(point, dist):
+
+    """
+    same as osmnx.utils_geo.bbox_from_point, without importing osmnx
+    :param point: lat, lng tuple
+    :param dist: distance in meters from point to the bbox edges
+    :return: (north, south, east, west) bounding box
+    """
+
+    lat, lng = point
+    delta_lat = (dist / EARTH_RADIUS_M) * (180 / np.pi)
+    delta_lng = delta_lat / np.cos(lat * np.pi / 180)
+
+    return lat + delta_lat, lat - delta_lat, lng + delta_lng, lng - delta_lng
+
+
+@timed('residences_fetch')
+def get_residence_df(bbox, building_store_path=None, max_connections=8, url=ARCGIS_REST_URL):
+
+    """
+    get bbox and return pandas df of buildings locations (arcgis query is split to sub envelopes / pages, fetched
+    concurrently, to get all the bbox buildings despite its 2000 records limit)
     :param bbox:
+    :param building_store_path: if passed, buildings are queried from local store (output of build_building_store)
+    :param max_connections: max # of concurrent arcgis connections
+    :param url: FeatureServer query url with ymax, ymin, xmax, xmin placeholders
     :return:
     """
 
+    if building_store_path:
+        from building_store import query_building_store
+
+        logging.info('query building store - START')
+        residence_df = query_building_store(building_store_path, bbox)
+        logging.info(f'query building store - END, {len(residence_df)} buildings')
+
+        return residence_df
+
     logging.info('query arcgis rest url - START')
 
-    residence_df = gpd.read_file(ARCGIS_REST_URL % bbox)
+    from arcgis_fetch import FeatureServerFetcher
+
+    residence_df = FeatureServerFetcher(url, max_connections=max_connections).fetch(bbox)
 
     residence_df['lat'] = residence_df['geometry'].centroid.y
     residence_df['lng'] = residence_df['geometry'].centroid.x
@@ -44,7 +95,8 @@ def get_residence_df(bbox):
     return residence_df
 
 
-def export_timeline_viz(signals, timeline, mobile_id, export_path):
+@timed('kepler_export')
+def export_timeline_viz(signals, timeline, mobile_id, export_path, mode='raw', max_rows=None):
 
     """
     Will generate an kepler.gl html file with mobile device signals and timeline
@@ -52,41 +104,25 @@ def export_timeline_viz(signals, timeline, mobile_id, export_path):
     :param timeline: timeline_df locations and times intervals
     :param mobile_id: unique mobile_id
     :param export_path: local path for export
+    :param mode: 'raw' - all signals, 'bins' - geohash bins of signals, 'drives' - simplified drives polylines
+    :param max_rows: max # of signals rows in the map, None for no limit
     :return:
     """
 
+    from viz import viz_datasets, save_kepler_html
 
-    with open('./kepler_config.json') as json_file:
-
-        config = json.load(json_file)
-
-    config['config']['mapState']['latitude'] = signals['lat1'].mean()
-    config['config']['mapState']['longitude'] = signals['lng1'].mean()
-
-    signals['timestamp'] = signals['timestamp'].astype(str)
-
-    timeline['start_time'] = timeline['start_time'].astype(str)
-    timeline['end_time'] = timeline['end_time'].astype(str)
+    save_kepler_html(viz_datasets(signals, timeline, mobile_id, mode, max_rows),
+                     os.path.join(export_path, f'{mobile_id}.html'))
 
-    kepler_map = KeplerGl(data={"timeline": timeline,
-                                "signals": signals},
-                          config=config)
 
-
-    file_name = f'{mobile_id}.html'
-
-    kepler_map.save_to_html(file_name=os.path.join(export_path, file_name))
-
-
-def get_kaggle_pois_data(kaggle_username, kaggle_key, export_path, bbox=None):
+def download_kaggle_pois_data(kaggle_username, kaggle_key, export_path):
 
     """
-    downloads public pois data from kaggle and return pandas object of pois
+    downloads public pois data from kaggle and return pandas df of all pois (poi_name, lat, lng)
     to generate kaggle username and key, see here - https://www.kaggle.com/docs/api
     :param kaggle_username: your kaggle username
     :param kaggle_key: your kaggle key
     :param export_path: path to export the data
-    :param bbox: if passed, will filter to pois within bbox only
     :return:
     """
 
@@ -118,7 +154,7 @@ def get_kaggle_pois_data(kaggle_username, kaggle_key, export_path, bbox=None):
 
     pois_dfs = [fs_df]
 
-    for chain_name in os.listdir('/content/pois_data'):
+    for chain_name in os.listdir(f'/{export_path}/pois_data'):
         chain_file = [i for i in os.listdir(f'/{export_path}/pois_data/{chain_name}') if i.endswith('.csv')][0]
         chain_df = pd.read_csv(os.path.join(f'/{export_path}/pois_data', chain_name, chain_file))
         chain_df['poi_name'] = chain_name
@@ -135,17 +171,71 @@ def get_kaggle_pois_data(kaggle_username, kaggle_key, export_path, bbox=None):
 
     pois_df = pd.concat(pois_dfs, ignore_index=True)
     pois_df = pois_df.dropna(subset=['lat', 'lng'], how='any')
-    if bbox:
-        pois_df = pois_df[pois_df.apply(lambda x: isin_box(x['lat'], x['lng'], bbox), axis=1)]
-    pois_df['id'] = pois_df.index
-    pois_df['geometry'] = pois_df.apply(lambda x: Point(x['lng'], x['lat']), axis=1)
-    pois_df = gpd.GeoDataFrame(pois_df)
 
     logging.info('getting pois data from Kaggle - END')
 
     return pois_df
 
 
+def build_poi_store(kaggle_username, kaggle_key, export_path, store_path):
+
+    """
+    will download all kaggle pois once and save them to local pois store (parquet sorted by grid cell)
+    :param kaggle_username: your kaggle username
+    :param kaggle_key: your kaggle key
+    :param export_path: path to export the data
+    :param store_path: path of the output parquet file
+    :return:
+    """
+
+    from grid_store import write_grid_store
+
+    pois_df = download_kaggle_pois_data(kaggle_username, kaggle_key, export_path)
+    pois_df['id'] = pois_df.index
+    pois_df['poi_name'] = pois_df['poi_name'].astype(str)
+
+    write_grid_store(pois_df, store_path)
+
+    logging.info(f'{len(pois_df)} pois saved to {store_path}')
+
+
+@timed('pois_load')
+def get_kaggle_pois_data(kaggle_username, kaggle_key, export_path, bbox=None, poi_store_path=None):
+
+    """
+    return geopandas df of public pois from kaggle
+    to generate kaggle username and key, see here - https://www.kaggle.com/docs/api
+    :param kaggle_username: your kaggle username
+    :param kaggle_key: your kaggle key
+    :param export_path: path to export the data
+    :param bbox: if passed, will filter to pois within bbox only
+    :param poi_store_path: if passed, pois are queried from local pois store (built on the first call)
+    :return:
+    """
+
+    if poi_store_path:
+        from grid_store import read_grid_store
+
+        if not os.path.exists(poi_store_path):
+            build_poi_store(kaggle_username, kaggle_key, export_path, poi_store_path)
+
+        pois_df = read_grid_store(poi_store_path, bbox) if bbox else pd.read_parquet(poi_store_path)
+        pois_df = pois_df.drop(columns='cell', errors='ignore').set_index('id', drop=False)
+        pois_df.index.name = None
+
+    else:
+        pois_df = download_kaggle_pois_data(kaggle_username, kaggle_key, export_path)
+        if bbox:
+            ymax, ymin, xmax, xmin = bbox
+            pois_df = pois_df[pois_df['lat'].between(ymin, ymax, inclusive='neither') &
+                              pois_df['lng'].between(xmin, xmax, inclusive='neither')]
+        pois_df['id'] = pois_df.index
+
+    import geopandas as gpd
+
+    return gpd.GeoDataFrame(pois_df, geometry=gpd.points_from_xy(pois_df['lng'], pois_df['lat']))
+
+
 def isin_box(lat, lng, bounds):
 
     """
@@ -167,7 +257,82 @@ def isin_box(lat, lng, bounds):
     return within
 
 
-def get_osmnx_graph(bbox=None, geo_str=None, import_gpickle_path=None, export_path=None):
+def load_compact_graph(import_path, mmap_mode='r'):
+
+    """
+    will load CompactGraph arrays (memory mapped by default, so all workers share one copy of the graph)
+    :param import_path: directory of the graph arrays (see get_osmnx_graph export_compact_path)
+    :param mmap_mode: np.load mmap_mode, None will read the arrays to memory
+    :return:
+    """
+
+    return CompactGraph.load(import_path, mmap_mode=mmap_mode)
+
+
+@timed('edge_geometries')
+def get_edge_geometries(G):
+
+    """
+    will build per edge coords arrays table of the graph, so routes geometries are concatenated arrays instead of
+    per edge shapely objects
+    :param G: MultiDiGraph / CompactGraph object
+    :return: CompactGraph object
+    """
+
+    return G if isinstance(G, CompactGraph) else CompactGraph.from_networkx(G)
+
+
+@timed('edges_snap')
+def snap_to_edges(G, locations_df):
+
+    """
+    will snap all locations to their nearest graph edge in one batch (edges r-tree) and add the columns
+    edge_u, edge_v, edge_key, edge_offset (normalized position along the edge geometry), snap_lat, snap_lng
+    :param G: MultiDiGraph object
+    :param locations_df: pandas df with lat, lng columns (residence_df / pois_df)
+    :return:
+    """
+
+    import geopandas as gpd
+    ox = import_osmnx()
+
+    logging.info(f'snap {len(locations_df)} locations to edges - START')
+
+    edges = ox.distance.nearest_edges(G, X=locations_df['lng'].values, Y=locations_df['lat'].values)
+    edges_gdf = ox.graph_to_gdfs(G, nodes=False, fill_edge_geometry=True)
+
+    edges_geo = gpd.GeoSeries(edges_gdf.loc[list(edges), 'geometry'].values, index=locations_df.index)
+    points_geo = gpd.GeoSeries(gpd.points_from_xy(locations_df['lng'], locations_df['lat']), index=locations_df.index)
+
+    locations_df['edge_u'], locations_df['edge_v'], locations_df['edge_key'] = zip(*edges)
+    locations_df['edge_offset'] = edges_geo.project(points_geo, normalized=True)
+    snapped_geo = edges_geo.interpolate(locations_df['edge_offset'].values, normalized=True)
+    locations_df['snap_lat'], locations_df['snap_lng'] = snapped_geo.y, snapped_geo.x
+
+    logging.info(f'snap {len(locations_df)} locations to edges - END')
+
+    return locations_df
+
+
+def get_location_snaps(*locations_dfs):
+
+    """
+    will return lookup of the snap_to_edges columns by location
+    :param locations_dfs: pandas dfs with snap_to_edges columns
+    :return: dict of lat,lng -> ((edge_u, edge_v, edge_key), (snap_lat, snap_lng))
+    """
+
+    location_snaps = {}
+    for locations_df in locations_dfs:
+        location_snaps.update(zip(zip(locations_df['lat'], locations_df['lng']),
+                                  zip(zip(locations_df['edge_u'], locations_df['edge_v'], locations_df['edge_key']),
+                                      zip(locations_df['snap_lat'], locations_df['snap_lng']))))
+
+    return location_snaps
+
+
+@timed('graph_build')
+def get_osmnx_graph(bbox=None, geo_str=None, import_gpickle_path=None, export_path=None, export_compact_path=None):
 
     """
     will query osm for all roads by bbox or geo_str and return MultiDiGraph object
@@ -175,6 +340,7 @@ def get_osmnx_graph(bbox=None, geo_str=None, import_gpickle_path=None, export_pa
     :param geo_str: name of the are, for example - "Rhode Island",'Massachusetts'
     :param import_gpickle_path: if passed, will load gpickle
     :param export_path: local path to export G pickle
+    :param export_compact_path: if passed, will also save the graph as CompactGraph arrays to this directory
     :return:
     """
 
@@ -182,6 +348,9 @@ def get_osmnx_graph(bbox=None, geo_str=None, import_gpickle_path=None, export_pa
 
     assert not (bbox and geo_str) or (bbox and import_gpickle_path) or (geo_str, import_gpickle_path), "please pass only one param of 'bbox' ,'geo_str', 'import_gpickle_path'"
 
+    import networkx as nx
+    ox = import_osmnx()
+
     G = None
 
     if bbox:
@@ -202,5 +371,8 @@ def get_osmnx_graph(bbox=None, geo_str=None, import_gpickle_path=None, export_pa
         file_name = datetime.datetime.now().isoformat() + '_G.gpickle'
         nx.write_gpickle(G, os.path.join(export_path, file_name))
 
+    if export_compact_path:
+        CompactGraph.from_networkx(G).save(export_compact_path)
+
     return G
 
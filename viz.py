@@ -0,0 +1,352 @@
+import os
+import copy
+import glob
+import json
+import uuid
+import shutil
+import logging
+import functools
+import numpy as np
+import pandas as pd
+from shapely.geometry import LineString
+
+from instrumentation import timed
+from utils import GEOHASH_BASE32
+
+VIZ_MODES = ('raw', 'bins', 'drives')
+MAX_GEOHASH_PRECISION = 9
+
+
+@functools.lru_cache()
+def read_kepler_config(config_path='./kepler_config.json'):
+
+    """
+    :param config_path: kepler.gl config json path
+    :return: kepler config dict, read once per process (do not mutate, see kepler_config)
+    """
+
+    with open(config_path) as json_file:
+        return json.load(json_file)
+
+
+def kepler_config(datasets, config_path='./kepler_config.json'):
+
+    """
+    will return a copy of the kepler config without the layers and tooltips of columns missing from datasets,
+    centered on the signals locations
+    :param datasets: dict of dataset name -> df (output of viz_datasets)
+    :param config_path: kepler.gl config json path
+    :return:
+    """
+
+    config = copy.deepcopy(read_kepler_config(config_path))
+    vis_state = config['config']['visState']
+
+    vis_state['layers'] = [layer for layer in vis_state['layers']
+                           if layer['config']['dataId'] in datasets and
+                           all(column is None or column in datasets[layer['config']['dataId']].columns
+                               for column in layer['config']['columns'].values())]
+
+    tooltip = vis_state['interactionConfig']['tooltip']['fieldsToShow']
+    for data_id in list(tooltip):
+        if data_id in datasets:
+            tooltip[data_id] = [field for field in tooltip[data_id] if field['name'] in datasets[data_id].columns]
+        else:
+            del tooltip[data_id]
+
+    if not datasets['signals'].empty:
+        config['config']['mapState']['latitude'] = float(datasets['signals']['lat1'].mean())
+        config['config']['mapState']['longitude'] = float(datasets['signals']['lng1'].mean())
+
+    return config
+
+
+def geohash_codes(lat, lng, precision):
+
+    """
+    vectorized geohash encoding
+    :param lat: array of latitudes
+    :param lng: array of longitudes
+    :param precision: geohash # of characters
+    :return: int64 array of geohash codes (5 bits per character, see geohash_strings)
+    """
+
+    n_bits = 5 * precision
+    lng_bits, lat_bits = (n_bits + 1) // 2, n_bits // 2
+
+    x = np.clip(((np.asarray(lng) + 180) / 360 * 2 ** lng_bits).astype(np.int64), 0, 2 ** lng_bits - 1)
+    y = np.clip(((np.asarray(lat) + 90) / 180 * 2 ** lat_bits).astype(np.int64), 0, 2 ** lat_bits - 1)
+
+    codes = np.zeros(len(x), dtype=np.int64)
+    for bit in range(n_bits):
+        # bits are interleaved starting with longitude
+        if bit % 2 == 0:
+            value = (x >> (lng_bits - 1 - bit // 2)) & 1
+        else:
+            value = (y >> (lat_bits - 1 - bit // 2)) & 1
+        codes = (codes << 1) | value
+
+    return codes
+
+
+def geohash_strings(codes, precision):
+
+    """
+    :param codes: geohash codes (output of geohash_codes)
+    :param precision: geohash # of characters
+    :return: list of geohash strings
+    """
+
+    return [''.join(GEOHASH_BASE32[(int(code) >> 5 * (precision - 1 - i)) & 31] for i in range(precision))
+            for code in codes]
+
+
+def signals_seconds(signals):
+
+    """
+    :param signals: signals df
+    :return: int64 array of signals unix seconds
+    """
+
+    return pd.to_datetime(signals['timestamp']).values.astype('datetime64[s]').astype(np.int64)
+
+
+def sample_signals(signals, max_rows):
+
+    """
+    :param signals: signals df (output of MobilePhone.generate_signals_df)
+    :param max_rows: max # of rows, signals are evenly thinned to fit
+    :return:
+    """
+
+    stride = int(np.ceil(len(signals) / max_rows)) if max_rows and len(signals) > max_rows else 1
+
+    return signals.iloc[::stride].copy()
+
+
+def bin_signals(signals, max_rows):
+
+    """
+    will aggregate signals to geohash bins, at the finest precision (up to MAX_GEOHASH_PRECISION) with at most
+    max_rows bins
+    :param signals: signals df (output of MobilePhone.generate_signals_df)
+    :param max_rows: max # of bins
+    :return: df of bins - geohash, mean location, # of signals, first and last signal time
+    """
+
+    codes = geohash_codes(signals['lat1'].values, signals['lng1'].values, MAX_GEOHASH_PRECISION)
+
+    precision = MAX_GEOHASH_PRECISION
+    while precision > 1 and max_rows and len(np.unique(codes)) > max_rows:
+        codes = codes >> 5  # one character coarser
+        precision -= 1
+
+    bins = signals.assign(code=codes, timestamp=pd.to_datetime(signals['timestamp'])) \
+        .groupby(['mobile_id', 'code'], sort=False) \
+        .agg(lat1=('lat1', 'mean'), lng1=('lng1', 'mean'), n_signals=('lat1', 'size'),
+             first_seen=('timestamp', 'min'), last_seen=('timestamp', 'max')) \
+        .reset_index()
+    bins['geohash'] = geohash_strings(bins.pop('code'), precision)
+
+    return bins
+
+
+def simplify_drives(signals, max_rows, drive_gap=120, tolerance=0.00001):
+
+    """
+    will reduce signals to simplified drives polylines - consecutive signals less than drive_gap seconds apart
+    are a drive, each drive is simplified (douglas peucker) with the smallest tolerance (doubled from tolerance)
+    that fits max_rows segments
+    :param signals: signals df (output of MobilePhone.generate_signals_df)
+    :param max_rows: max # of segments
+    :param drive_gap: max seconds between two drive signals (stays are sampled every ~10 minutes)
+    :param tolerance: initial simplify tolerance in degrees
+    :return: df of drives segments - drive_id, lat1, lng1, lat2, lng2, drive start and end time
+    """
+
+    signals = signals.sort_values('timestamp')
+    seconds = signals_seconds(signals)
+    coords = signals[['lng1', 'lat1']].values
+
+    moving = np.diff(seconds) < drive_gap
+    starts = np.flatnonzero(moving & ~np.concatenate([[False], moving[:-1]]))
+    ends = np.flatnonzero(moving & ~np.concatenate([moving[1:], [False]])) + 1
+
+    if max_rows and len(starts) > max_rows:  # even a single segment per drive is over budget, keep evenly spaced drives
+        keep = np.linspace(0, len(starts) - 1, max_rows).astype(int)
+        starts, ends = starts[keep], ends[keep]
+
+    while True:
+        lines = [np.asarray(LineString(coords[start:end + 1]).simplify(tolerance).coords)
+                 for start, end in zip(starts, ends)]
+        if not max_rows or sum(len(line) - 1 for line in lines) <= max_rows:
+            break
+        tolerance *= 2
+
+    mobile_ids = signals['mobile_id'].values
+    times = pd.to_datetime(signals['timestamp']).values
+
+    return pd.DataFrame({'mobile_id': np.repeat(mobile_ids[starts], [len(line) - 1 for line in lines]),
+                         'drive_id': np.repeat(np.arange(len(lines)), [len(line) - 1 for line in lines]),
+                         'lat1': np.concatenate([line[:-1, 1] for line in lines] or [[]]),
+                         'lng1': np.concatenate([line[:-1, 0] for line in lines] or [[]]),
+                         'lat2': np.concatenate([line[1:, 1] for line in lines] or [[]]),
+                         'lng2': np.concatenate([line[1:, 0] for line in lines] or [[]]),
+                         'start_time': np.repeat(times[starts], [len(line) - 1 for line in lines]),
+                         'end_time': np.repeat(times[ends], [len(line) - 1 for line in lines])})
+
+
+def timeline_places(timeline, mobile_id):
+
+    """
+    :param timeline: timeline df (MobilePhone.mobile_timeline)
+    :param mobile_id: unique identifier of the mobile device
+    :return: df of the distinct stays places of the timeline, with # of stays and total stay hours
+    """
+
+    timeline = timeline.assign(mobile_id=mobile_id, poi_id=timeline['poi_id'].astype(str),
+                               hours=(pd.to_datetime(timeline['end_time']) -
+                                      pd.to_datetime(timeline['start_time'])).dt.total_seconds() / 3600)
+
+    return timeline.groupby(['mobile_id', 'poi_id', 'poi_name', 'poi_type', 'lat', 'lng'], sort=False) \
+        .agg(n_stays=('hours', 'size'), hours=('hours', 'sum')) \
+        .reset_index()
+
+
+def viz_datasets(signals, timeline, mobile_id, mode='raw', max_rows=None):
+
+    """
+    will reduce mobile device signals and timeline to kepler datasets
+    :param signals: signals df (output of MobilePhone.generate_signals_df)
+    :param timeline: timeline df (MobilePhone.mobile_timeline)
+    :param mobile_id: unique identifier of the mobile device
+    :param mode: 'raw' - signals (evenly thinned to max_rows), 'bins' - geohash bins of signals,
+                 'drives' - simplified drives polylines. 'bins' and 'drives' reduce the timeline to its places
+    :param max_rows: max # of signals rows, None for no limit
+    :return: dict of dataset name -> df, times as strings
+    """
+
+    assert mode in VIZ_MODES, f'mode should be one of {VIZ_MODES}, got {mode}'
+
+    if mode == 'raw':
+        signals = sample_signals(signals, max_rows)
+        timeline = timeline.assign(mobile_id=mobile_id)
+    elif mode == 'bins':
+        signals = bin_signals(signals, max_rows)
+        timeline = timeline_places(timeline, mobile_id)
+    else:
+        signals = simplify_drives(signals, max_rows)
+        timeline = timeline_places(timeline, mobile_id)
+
+    datasets = {'signals': signals, 'timeline': timeline}
+    for df in datasets.values():
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = df[column].astype(str)
+
+    return datasets
+
+
+def save_kepler_html(datasets, file_path):
+
+    """
+    :param datasets: dict of dataset name -> df (output of viz_datasets)
+    :param file_path: html file path
+    :return:
+    """
+
+    from keplergl import KeplerGl  # heavy, imported only when a map is saved
+
+    KeplerGl(data=datasets, config=kepler_config(datasets)).save_to_html(file_name=file_path)
+
+
+class KeplerViz:
+
+    def __init__(self, export_path, mode='raw', max_rows=100000, combined=False):
+
+        """
+        will export kepler.gl html maps of mobile devices signals and timelines to {export_path}/viz
+        :param export_path: export path to save output data
+        :param mode: 'raw' / 'bins' / 'drives' (see viz_datasets)
+        :param max_rows: max # of signals rows per mobile device
+        :param combined: if True, devices are collected to parts files (one per process) and saved as a single
+                         multi devices map by save_combined_viz, otherwise each device is saved to {mobile_id}.html
+        """
+
+        self.viz_path = os.path.join(export_path, 'viz')
+        self.mode = mode
+        self.max_rows = max_rows
+        self.combined = combined
+        self.parts = {'signals': [], 'timeline': []}
+        os.makedirs(os.path.join(self.viz_path, 'parts') if combined else self.viz_path, exist_ok=True)
+
+    @timed('kepler_export')
+    def add(self, mobile_id, signals, timeline):
+
+        """
+        :param mobile_id: unique identifier of the mobile device
+        :param signals: signals df (output of MobilePhone.generate_signals_df)
+        :param timeline: timeline df (MobilePhone.mobile_timeline)
+        :return:
+        """
+
+        datasets = viz_datasets(signals, timeline, mobile_id, self.mode, self.max_rows)
+
+        if self.combined:
+            for name, df in datasets.items():
+                self.parts[name].append(df)
+        else:
+            save_kepler_html(datasets, os.path.join(self.viz_path, f'{mobile_id}.html'))
+
+    def close(self):
+
+        """
+        will save the collected devices datasets to this process parts files
+        :return:
+        """
+
+        if self.combined and self.parts['signals']:
+            part_id = uuid.uuid4().hex[:12]
+            for name, dfs in self.parts.items():
+                pd.concat(dfs, ignore_index=True).to_csv(os.path.join(self.viz_path, 'parts', f'{part_id}_{name}.csv'),
+                                                         index=False)
+                dfs.clear()
+
+
+def clear_viz_parts(export_path):
+
+    """
+    :param export_path: export path to save output data
+    :return:
+    """
+
+    shutil.rmtree(os.path.join(export_path, 'viz', 'parts'), ignore_errors=True)
+
+
+@timed('kepler_export')
+def save_combined_viz(export_path, name='mobiles'):
+
+    """
+    will save all the processes parts files (see KeplerViz combined) as a single kepler.gl map
+    :param export_path: export path to save output data
+    :param name: html file name
+    :return: html file path
+    """
+
+    parts_path = os.path.join(export_path, 'viz', 'parts')
+    datasets = {}
+    for dataset in ('signals', 'timeline'):
+        paths = sorted(glob.glob(os.path.join(parts_path, f'*_{dataset}.csv')))
+        datasets[dataset] = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True) if paths \
+            else pd.DataFrame()
+
+    if datasets['signals'].empty:
+        logging.info('no mobile devices to visualize')
+        return None
+
+    file_path = os.path.join(export_path, 'viz', f'{name}.html')
+    save_kepler_html(datasets, file_path)
+    clear_viz_parts(export_path)
+    logging.info(f'saved {len(datasets["signals"])} signals rows map to {file_path}')
+
+    return file_path
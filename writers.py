@@ -0,0 +1,222 @@
+import os
+import uuid
+import zlib
+import logging
+import threading
+import pandas as pd
+
+from instrumentation import timed, timed_stage
+from manifest import RunManifest
+
+FLOAT32_COLUMNS = ('lat', 'lng', 'lat1', 'lng1', 'lat2', 'lng2')
+CATEGORY_COLUMNS = ('mobile_type', 'poi_type')
+TIME_COLUMNS = ('timestamp', 'start_time', 'end_time')
+
+
+def signals_chunks(signals):
+
+    """
+    :param signals: signals df, or iterable of time ordered signals dfs (output of MobilePhone.iter_signals)
+    :return: iterable of signals dfs
+    """
+
+    return [signals] if isinstance(signals, pd.DataFrame) else signals
+
+
+class CSVWriter:
+
+    def __init__(self, export_path, manifest_path=None, file_suffix=''):
+
+        """
+        will save signals and timeline csv files per mobile device
+        :param export_path: export path to save output data
+        :param manifest_path: manifest directory to record completed mobile devices in (for resumable runs)
+        :param file_suffix: suffix of the files names, e.g. to keep the files of previous runs
+        """
+
+        self.export_path = export_path
+        self.file_suffix = file_suffix
+        self.manifest = RunManifest(manifest_path) if manifest_path else None
+        os.makedirs(os.path.join(export_path, 'signals'), exist_ok=True)
+        os.makedirs(os.path.join(export_path, 'timelines'), exist_ok=True)
+
+    def write(self, mobile_id, signals, timeline):
+
+        """
+        :param mobile_id: unique identifier of the mobile device
+        :param signals: signals df (output of MobilePhone.generate_signals_df) or signals chunks (output of
+                        MobilePhone.iter_signals), chunks are appended to the file as they are generated
+        :param timeline: timeline df (MobilePhone.mobile_timeline)
+        :return:
+        """
+
+        signals_path = os.path.join(f'{self.export_path}/signals', f'signals_{mobile_id}{self.file_suffix}.csv')
+        timeline_path = os.path.join(f'{self.export_path}/timelines', f'timeline_{mobile_id}{self.file_suffix}.csv')
+
+        signals_rows = 0
+        with open(signals_path, 'w', newline='') as file:
+            for chunk in signals_chunks(signals):  # lazy chunks are generated here, only the export is timed
+                with timed_stage('csv_export'):
+                    chunk.to_csv(file, index=False, header=signals_rows == 0) # save signals data
+                signals_rows += len(chunk)
+        with timed_stage('csv_export'):
+            timeline.to_csv(timeline_path, index=False) # save timeline data
+
+        if self.manifest:
+            self.manifest.record(mobile_id, [signals_path, timeline_path], signals_rows, len(timeline))
+
+    def flush(self):
+
+        pass
+
+    def close(self):
+
+        if self.manifest:
+            self.manifest.close()
+
+
+class ParquetWriter:
+
+    def __init__(self, export_path, max_rows=1000000, n_buckets=16, manifest_path=None):
+
+        """
+        will stream mobile devices into signals and timelines parquet datasets, partitioned by date and device bucket
+        (hash of mobile_id). columns are typed - float32 locations, int64 unix seconds times, categorical types
+        :param export_path: export path to save output data
+        :param max_rows: max # of rows to buffer in memory before writing a batch of files
+        :param n_buckets: # of device buckets partitions
+        :param manifest_path: manifest directory to record completed mobile devices in (for resumable runs),
+        devices are recorded only once their batch is flushed
+        """
+
+        self.export_path = export_path
+        self.max_rows = max_rows
+        self.n_buckets = n_buckets
+        self.writer_id = uuid.uuid4().hex[:12]  # unique files names across processes writing to the same dataset
+        self.batches = {'signals': [], 'timelines': []}
+        self.n_rows = 0
+        self.n_flushes = 0
+        self.pending = []  # (mobile_id, signals rows, timeline rows) of buffered devices
+        self.manifest = RunManifest(manifest_path, self.writer_id) if manifest_path else None
+        self.lock = threading.RLock()  # buffers are shared by the writer threads (see pipeline.WritePipeline)
+
+    def device_bucket(self, mobile_id):
+
+        """
+        :param mobile_id: unique identifier of the mobile device
+        :return: stable (across processes and runs) bucket of mobile_id
+        """
+
+        return zlib.crc32(str(mobile_id).encode()) % self.n_buckets
+
+    def typed_table(self, df, mobile_id, time_column):
+
+        """
+        will convert df to typed arrow table with date and device_bucket partition columns
+        :param df: signals / timeline df
+        :param mobile_id: unique identifier of the mobile device
+        :param time_column: column to derive the date partition from
+        :return:
+        """
+
+        import pyarrow as pa
+
+        df = df.copy()
+        df['mobile_id'] = mobile_id
+        df['date'] = pd.to_datetime(df[time_column]).dt.strftime('%Y-%m-%d')
+        df['device_bucket'] = self.device_bucket(mobile_id)
+
+        for column in df.columns:
+            if column in FLOAT32_COLUMNS:
+                df[column] = df[column].astype('float32')
+            elif column in TIME_COLUMNS:
+                df[column] = pd.to_datetime(df[column]).values.astype('int64') // 10 ** 9
+            elif column in CATEGORY_COLUMNS:
+                df[column] = df[column].astype(str).astype('category')
+            elif df[column].dtype == object:
+                df[column] = df[column].astype(str)  # mixed types columns, e.g poi_id - 'home' / int
+
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    def write(self, mobile_id, signals, timeline):
+
+        """
+        :param mobile_id: unique identifier of the mobile device
+        :param signals: signals df (output of MobilePhone.generate_signals_df) or signals chunks (output of
+                        MobilePhone.iter_signals), chunks are converted to arrow tables as they are generated
+        :param timeline: timeline df (MobilePhone.mobile_timeline)
+        :return:
+        """
+
+        signals_tables = []
+        for chunk in signals_chunks(signals):  # lazy chunks are generated here, only the conversion is timed
+            with timed_stage('parquet_buffer'):
+                signals_tables.append(self.typed_table(chunk, mobile_id, 'timestamp'))
+        with timed_stage('parquet_buffer'):
+            timeline_table = self.typed_table(timeline, mobile_id, 'start_time')
+        signals_rows = sum(table.num_rows for table in signals_tables)
+
+        with self.lock:
+            self.batches['signals'].extend(signals_tables)
+            self.batches['timelines'].append(timeline_table)
+            self.n_rows += signals_rows + len(timeline)
+            self.pending.append((mobile_id, signals_rows, len(timeline)))
+
+            if self.n_rows >= self.max_rows:
+                self.flush()
+
+    @timed('parquet_flush')
+    def flush(self):
+
+        """
+        will write buffered devices as one file per partition
+        :return:
+        """
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        with self.lock:
+            prefix = f'{self.writer_id}-{self.n_flushes}'
+            for name, tables in self.batches.items():
+                if tables:
+                    pq.write_to_dataset(pa.concat_tables(tables, promote=True),
+                                        root_path=os.path.join(self.export_path, name),
+                                        partition_cols=['date', 'device_bucket'],
+                                        basename_template=f'{prefix}-{{i}}.parquet',
+                                        existing_data_behavior='overwrite_or_ignore')
+                    tables.clear()
+
+            if self.manifest:
+                for mobile_id, signals_rows, timeline_rows in self.pending:
+                    self.manifest.record(mobile_id, prefix, signals_rows, timeline_rows)
+            self.pending.clear()
+
+            if self.n_rows:
+                logging.info(f'written {self.n_rows} rows to parquet datasets')
+            self.n_rows = 0
+            self.n_flushes += 1
+
+    def close(self):
+
+        self.flush()
+        if self.manifest:
+            self.manifest.close()
+
+
+def get_writer(export_path, output_format='csv', manifest_path=None, **kwargs):
+
+    """
+    :param export_path: export path to save output data
+    :param output_format: 'csv' - csv files per mobile device, 'parquet' - partitioned parquet datasets
+    :param manifest_path: manifest directory to record completed mobile devices in (for resumable runs)
+    :param kwargs: ParquetWriter / CSVWriter params
+    :return:
+    """
+
+    assert output_format in ('csv', 'parquet'), f"output_format should be 'csv' or 'parquet', got {output_format}"
+
+    if output_format == 'parquet':
+        return ParquetWriter(export_path, manifest_path=manifest_path, **kwargs)
+
+    return CSVWriter(export_path, manifest_path=manifest_path, **kwargs)